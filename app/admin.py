@@ -34,6 +34,13 @@ class CustomUserAdmin(UserAdmin):
 
 class EntryAdmin(admin.ModelAdmin):
     list_display = ("__str__", "user_formatted", "parent_formatted", "created_date")
+    actions = ["soft_delete_entries"]
+
+    def soft_delete_entries(self, request, queryset):
+        deleted = queryset.soft_delete()
+        self.message_user(request, f"Deleted {deleted} entries.")
+
+    soft_delete_entries.short_description = "Mark selected entries as deleted"
 
 
 admin.site.register(User, CustomUserAdmin)
@@ -2,12 +2,15 @@
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.utils.decorators import method_decorator
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
-from rest_framework.permissions import IsAuthenticated
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
+from .conditional import conditional_entry
 from .models import Entry, Notification, PrivateMessage, Tag, User
 from .permissions import (
     DeletedReadOnly,
@@ -19,12 +22,15 @@
     PrivateMessagePostAndGetOnly,
     TagGetOnly,
 )
+from .search import InvalidCursor, search_entries
 from .serializers import (
     EntrySerializer,
     NotificationSerializer,
     PrivateMessageSerializer,
     TagSerializer,
 )
+from .timeline import get_timeline
+from .trending import get_trending_tags
 
 
 class TagViewSet(viewsets.ModelViewSet):
@@ -42,7 +48,10 @@ def blacklist(self, request, pk=None):
             if tag.observers.filter(username=self.request.user.username):
                 tag.observers.remove(self.request.user)
             tag.blacklisters.add(self.request.user)
-        serializer = self.serializer_class(tag, context={"request": request})
+        Tag.objects.clear_blacklisted_by(self.request.user)
+        serializer = self.serializer_class(
+            self.get_queryset().get(pk=tag.pk), context={"request": request}
+        )
         return Response(serializer.data)
 
     @action(detail=True, methods=["post"])
@@ -56,11 +65,22 @@ def observe(self, request, pk=None):
             if tag.blacklisters.filter(username=self.request.user.username):
                 tag.blacklisters.remove(self.request.user)
             tag.observers.add(self.request.user)
-        serializer = self.serializer_class(tag, context={"request": request})
+        Tag.objects.clear_blacklisted_by(self.request.user)
+        serializer = self.serializer_class(
+            self.get_queryset().get(pk=tag.pk), context={"request": request}
+        )
         return Response(serializer.data)
 
     def get_queryset(self):
-        return Tag.objects.all()
+        return Tag.objects.with_api_data(self.request.user)
+
+
+class TrendingTagViewSet(viewsets.ViewSet):
+    # Not an action of TagViewSet, which would shadow a tag named "trending"
+    permission_classes = [IsAuthenticated]
+
+    def list(self, request):
+        return Response(get_trending_tags())
 
 
 class NotificationViewSet(viewsets.ModelViewSet):
@@ -69,7 +89,7 @@ class NotificationViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["post"])
     def read_all(self, request):
-        user_notifications = Notification.objects.filter(target=self.request.user)
+        user_notifications = self.get_queryset()
         user_notifications.update(read=True)
         page = self.paginate_queryset(user_notifications)
         if page:
@@ -90,9 +110,7 @@ def read(self, request, pk=None):
 
     @action(detail=False, methods=["get"])
     def unread(self, request):
-        unread_notifications = Notification.objects.filter(
-            target=self.request.user
-        ).filter(read=False)
+        unread_notifications = self.get_queryset().filter(read=False)
         page = self.paginate_queryset(unread_notifications)
         if page:
             serializer = self.get_serializer(page, many=True)
@@ -101,7 +119,9 @@ def unread(self, request):
         return Response(serializer.data)
 
     def get_queryset(self):
-        return Notification.objects.filter(target=self.request.user)
+        return Notification.objects.filter(target=self.request.user).select_related(
+            "sender", "target"
+        )
 
 
 class PrivateMessageViewSet(viewsets.ModelViewSet):
@@ -114,8 +134,10 @@ class PrivateMessageViewSet(viewsets.ModelViewSet):
 
     @action(detail=False, methods=["get"])
     def unread(self, request):
-        unread_pms = PrivateMessage.objects.filter(target=self.request.user).filter(
-            read=False
+        unread_pms = (
+            PrivateMessage.objects.filter(target=self.request.user)
+            .filter(read=False)
+            .select_related("author", "target")
         )
         author = request.GET.get("from", None)
         if author:
@@ -163,7 +185,7 @@ def get_queryset(self):
         """
         private_messages = PrivateMessage.objects.filter(
             Q(author=self.request.user) | Q(target=self.request.user)
-        )
+        ).select_related("author", "target")
         q_read = self.request.query_params.get("read", None)
         if q_read:
             q_read = q_read.lower()
@@ -195,33 +217,106 @@ class EntryViewSet(viewsets.ModelViewSet):
         DeletedReadOnly,
     ]
 
+    def get_queryset(self):
+        return Entry.objects.with_api_data(self.request.user)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
     @action(detail=True, methods=["post"])
     def upvote(self, request, pk=None):
         entry = self.get_object()
-        if request.user in entry.downvotes.all():
+        if entry.user_downvoted:
             entry.downvotes.remove(request.user)
-        if request.user in entry.upvotes.all():
+        if entry.user_upvoted:
             entry.upvotes.remove(request.user)
         else:
             entry.upvotes.add(request.user)
-        serializer = self.get_serializer(entry)
+        serializer = self.get_serializer(self.get_queryset().get(pk=entry.pk))
         return Response(serializer.data)
 
     @action(detail=True, methods=["post"])
     def downvote(self, request, pk=None):
         entry = self.get_object()
-        if request.user in entry.upvotes.all():
+        if entry.user_upvoted:
             entry.upvotes.remove(request.user)
-        if request.user in entry.downvotes.all():
+        if entry.user_downvoted:
             entry.downvotes.remove(request.user)
         else:
             entry.downvotes.add(request.user)
-        serializer = self.get_serializer(entry)
+        serializer = self.get_serializer(self.get_queryset().get(pk=entry.pk))
         return Response(serializer.data)
 
+    @action(detail=False, methods=["post"], permission_classes=[IsAdminUser])
+    def bulk_delete(self, request):
+        """
+        Deletes many entries at once (staff only). API accepts parameters:
+        ::ids  - list of ids of entries to delete
+        ::user - username of user whose entries will be deleted
+        """
+        ids = request.data.get("ids")
+        username = request.data.get("user")
+        if not ids and not username:
+            raise ValidationError("Pass 'ids' or 'user' of entries to delete")
+        queryset = Entry.objects.all()
+        if ids:
+            if not isinstance(ids, list) or not all(isinstance(pk, int) for pk in ids):
+                raise ValidationError("'ids' must be a list of integers")
+            queryset = queryset.filter(pk__in=ids)
+        if username:
+            queryset = queryset.filter(user__username=str(username).lower())
+        return Response({"deleted": queryset.soft_delete()})
+
+    @action(detail=False, methods=["get"])
+    def search(self, request):
+        """
+        Full-text search of entries. API accepts parameters:
+        ::q      - search query
+        ::user   - if set will return entries of that user only
+        ::tag    - if set will return entries with that tag only
+        ::cursor - cursor to the next page of results
+        """
+        try:
+            ids, next_cursor = search_entries(
+                request.query_params.get("q", ""),
+                request.query_params.get("user"),
+                request.query_params.get("tag"),
+                request.query_params.get("cursor"),
+            )
+        except InvalidCursor as e:
+            raise ValidationError(str(e))
+        entries = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [entries[pk] for pk in ids if pk in entries], many=True
+        )
+        next_url = None
+        if next_cursor:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "cursor", next_cursor
+            )
+        return Response({"next": next_url, "results": serializer.data})
+
+    @action(detail=False, methods=["get"])
+    def timeline(self, request):
+        """
+        Root entries with tags observed by user (newest first). API accepts parameters:
+        ::before - id of the last entry of the previous page
+        """
+        before = request.query_params.get("before")
+        if before is not None and not before.isdigit():
+            raise ValidationError("Invalid cursor")
+        ids, next_before = get_timeline(request.user, int(before) if before else None)
+        entries = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer(
+            [entries[pk] for pk in ids if pk in entries], many=True
+        )
+        next_url = None
+        if next_before:
+            next_url = replace_query_param(
+                request.build_absolute_uri(), "before", next_before
+            )
+        return Response({"next": next_url, "results": serializer.data})
+
     def list(self, request):
         queryset = self.get_queryset()
         page = self.paginate_queryset(queryset)
@@ -235,8 +330,9 @@ def list(self, request):
         )
         return Response(serializer.data)
 
+    @method_decorator(conditional_entry("api"))
     def retrieve(self, request, pk=None):
-        entry = get_object_or_404(Entry, pk=pk)
+        entry = get_object_or_404(self.get_queryset(), pk=pk)
         context = {"request": request}
         serializer = self.serializer_class(entry, many=False, context=context)
         return Response(serializer.data)
@@ -0,0 +1,130 @@
+"""
+Archive of deleted entries.
+
+DeletedEntry records older than DELETED_ENTRY_RETENTION_DAYS are moved in
+batches to append-only gzipped JSON lines files in DELETED_ENTRY_ARCHIVE_DIR
+(one file per month of deletion) by 'python manage.py archive_deleted_entries'.
+Every batch is appended as a new gzip member and synced to disk before its
+records are deleted from db, so an interrupted run never loses a record
+(it may archive it twice).
+
+Records can be looked up (and restored to db) with
+'python manage.py deleted_entry <old_id>'.
+"""
+import glob
+import gzip
+import json
+import os
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import DeletedEntry
+
+ARCHIVE_FILE_PATTERN = "deleted-entries-{:%Y-%m}.jsonl.gz"
+
+
+def serialize_deleted_entry(deleted):
+    return {
+        "old_id": deleted.old_id,
+        "user": deleted.user,
+        "parent": deleted.parent,
+        "content": deleted.content,
+        "upvoters": deleted.upvoter_ids,
+        "downvoters": deleted.downvoter_ids,
+        "created_on": deleted.created_on.isoformat(),
+        "deleted_on": deleted.deleted_on.isoformat(),
+    }
+
+
+def _append(path, lines):
+    with open(path, "ab") as f:
+        with gzip.GzipFile(fileobj=f, mode="wb") as archive:
+            archive.write("".join(line + "\n" for line in lines).encode())
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def archive_deleted_entries(now=None, batch_size=None):
+    """
+    Moves records deleted more than DELETED_ENTRY_RETENTION_DAYS ago
+    from db to archive files. Returns number of archived records.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.DELETED_ENTRY_ARCHIVE_BATCH_SIZE
+    until = now - timedelta(days=settings.DELETED_ENTRY_RETENTION_DAYS)
+    os.makedirs(settings.DELETED_ENTRY_ARCHIVE_DIR, exist_ok=True)
+    archived = 0
+    last_pk = 0
+    while True:
+        batch = list(
+            DeletedEntry.objects.filter(deleted_on__lt=until, pk__gt=last_pk).order_by(
+                "pk"
+            )[:batch_size]
+        )
+        if not batch:
+            return archived
+        files = defaultdict(list)
+        for deleted in batch:
+            path = os.path.join(
+                settings.DELETED_ENTRY_ARCHIVE_DIR,
+                ARCHIVE_FILE_PATTERN.format(deleted.deleted_on),
+            )
+            files[path].append(
+                json.dumps(serialize_deleted_entry(deleted), separators=(",", ":"))
+            )
+        for path, lines in files.items():
+            _append(path, lines)
+        last_pk = batch[-1].pk
+        DeletedEntry.objects.filter(pk__in=[deleted.pk for deleted in batch]).delete()
+        archived += len(batch)
+
+
+def find_deleted_entry(old_id):
+    """
+    Returns record of a deleted entry as a dict (or None if it's not found).
+    Record is looked up in db first and then in archive files, newest first.
+    """
+    deleted = DeletedEntry.objects.filter(old_id=old_id).first()
+    if deleted is not None:
+        return serialize_deleted_entry(deleted)
+    # Records are serialized with 'old_id' first so lines can be matched by prefix
+    prefix = f'{{"old_id":{old_id},'
+    paths = glob.glob(
+        os.path.join(settings.DELETED_ENTRY_ARCHIVE_DIR, "deleted-entries-*.jsonl.gz")
+    )
+    for path in sorted(paths, reverse=True):
+        with gzip.open(path, "rt") as archive:
+            for line in archive:
+                if line.startswith(prefix):
+                    return json.loads(line)
+    return None
+
+
+def restore_deleted_entry(old_id):
+    """
+    Copies archived record of a deleted entry back to db.
+    Returns DeletedEntry (or None if record is not found).
+    """
+    deleted = DeletedEntry.objects.filter(old_id=old_id).first()
+    if deleted is not None:
+        return deleted
+    record = find_deleted_entry(old_id)
+    if record is None:
+        return None
+    deleted = DeletedEntry.objects.create(
+        old_id=record["old_id"],
+        user=record["user"],
+        parent=record["parent"],
+        content=record["content"],
+        upvoters=DeletedEntry.dump_ids(record["upvoters"]),
+        downvoters=DeletedEntry.dump_ids(record["downvoters"]),
+        created_on=parse_datetime(record["created_on"]),
+    )
+    # deleted_on is set automatically on create, bring back the original date
+    deleted.deleted_on = parse_datetime(record["deleted_on"])
+    DeletedEntry.objects.filter(pk=deleted.pk).update(deleted_on=deleted.deleted_on)
+    return deleted
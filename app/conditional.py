@@ -0,0 +1,101 @@
+"""
+Conditional GET of entries.
+
+ETag of an entry is made of its id, the version of its discussion, the user
+(pages differ per user) and for HTML pages unread counts shown in the navbar.
+The version of a discussion is read from the database: number of entries
+and date of the last change (creation, edit or deletion) of any of them,
+number of votes and id of the last vote of each kind. So every process sees
+every change, without a shared cache.
+Last-Modified is the date of the last change of the discussion.
+All of it is computed with a single query, so requests with matching
+If-None-Match are answered with 304 before any template or serializer work.
+
+Votes and notifications have no dates, so If-Modified-Since alone (without
+If-None-Match) never gets a 304.
+"""
+from django.db.models import DateTimeField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.views.decorators.http import condition
+
+from .models import Entry, Notification, PrivateMessage, subquery_count
+
+
+def subquery_max(queryset, expression, field, output_field=None):
+    """
+    Turns a queryset filtered by OuterRef on field into a MAX subquery
+    """
+    return Subquery(
+        queryset.order_by().values(field).annotate(max=Max(expression)).values("max"),
+        output_field=output_field,
+    )
+
+
+def entry_state(request, pk, kind):
+    """
+    Returns (etag, last_modified) of an entry or None if it doesn't exist.
+    Result is stored on request so it's computed once per request.
+    """
+    if not hasattr(request, "_entry_state"):
+        request._entry_state = None
+        if not str(pk).isdigit():
+            return None
+        thread = Entry.objects.filter(tree_id=OuterRef("tree_id"))
+        columns = {
+            "last_change": subquery_max(
+                thread,
+                Coalesce("modified_date", "created_date"),
+                "tree_id",
+                output_field=DateTimeField(),
+            ),
+            "entries": subquery_count(thread, field="tree_id"),
+        }
+        for field in ("upvotes", "downvotes"):
+            votes = getattr(Entry, field).through.objects.filter(
+                entry__tree_id=OuterRef("tree_id")
+            )
+            columns[f"{field}_count"] = subquery_count(votes, field="entry__tree_id")
+            columns[f"last_{field}"] = subquery_max(votes, "pk", "entry__tree_id")
+        user = request.user
+        if kind == "html" and user.is_authenticated:
+            columns["notifications"] = subquery_count(
+                Notification.objects.filter(target=user, read=False), field="target"
+            )
+            columns["messages"] = subquery_count(
+                PrivateMessage.objects.filter(target=user, read=False), field="target",
+            )
+        row = (
+            Entry.objects.filter(pk=pk)
+            .annotate(**columns)
+            .values_list(*columns)
+            .first()
+        )
+        if row is not None:
+            last_change, *counts = row
+            version = "-".join(str(value or 0) for value in counts)
+            etag = f"{kind}-{pk}-{last_change.timestamp()}-{version}-{user.pk or 0}"
+            request._entry_state = (etag, last_change)
+    return request._entry_state
+
+
+def conditional_entry(kind):
+    """
+    Decorator adding ETag and Last-Modified to views of an entry
+    (with 'pk' URL argument). 'kind' makes ETags of different
+    representations (e.g. HTML and API) differ.
+    """
+
+    def etag(request, pk, **kwargs):
+        state = entry_state(request, pk, kind)
+        return state[0] if state else None
+
+    def last_modified(request, pk, **kwargs):
+        if (
+            "HTTP_IF_MODIFIED_SINCE" in request.META
+            and "HTTP_IF_NONE_MATCH" not in request.META
+        ):
+            return None
+        state = entry_state(request, pk, kind)
+        return state[1] if state else None
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,115 @@
+"""
+Database routing, connection health checks and backend specific queries.
+
+Reads of safe (GET, HEAD, OPTIONS) requests go to read replicas listed in
+DATABASE_REPLICAS, everything else goes to the primary ('default') database.
+ReplicaMiddleware (see app.middleware) sets up routing of every request: once
+a request writes, its remaining reads go to the primary and the client is
+pinned to the primary for REPLICA_PIN_SECONDS, so users always see their own
+posts and votes even if replicas lag behind. Reads outside of requests
+(management commands, tests) always go to the primary.
+
+Connections are persistent (CONN_MAX_AGE) so a connection closed by the
+server (restart, idle timeout, failover) would break the next request.
+With DATABASE_HEALTH_CHECKS every open connection is checked when a request
+starts and reopened if it's not usable.
+
+Queries which have faster forms on some backends (window functions,
+INSERT ... ON CONFLICT) check connection features or vendor and fall back
+to portable queries on other databases.
+"""
+import random
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.expressions import RawSQL
+
+routing = ContextVar("routing", default=None)
+
+
+class Routing:
+    """
+    Routing state of a request
+
+    ::use_replicas - true if reads may go to replicas
+    ::written      - true if request has written to the primary
+    """
+
+    def __init__(self, use_replicas):
+        self.use_replicas = use_replicas
+        self.written = False
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the primary and reads of read-only requests to replicas
+    """
+
+    def db_for_read(self, model, **hints):
+        state = routing.get()
+        if state is None:
+            return None
+        if (
+            not state.use_replicas
+            or state.written
+            or not settings.DATABASE_REPLICAS
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            # Objects read from a replica earlier would otherwise keep using it
+            return DEFAULT_DB_ALIAS
+        return random.choice(settings.DATABASE_REPLICAS)
+
+    def db_for_write(self, model, **hints):
+        state = routing.get()
+        if state is not None:
+            state.written = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+
+def check_connections():
+    """
+    Closes open connections which don't respond, they are reopened on next use
+    """
+    if not settings.DATABASE_HEALTH_CHECKS:
+        return
+    for connection in connections.all():
+        if connection.connection is None or connection.in_atomic_block:
+            continue
+        if not connection.is_usable():
+            connection.close()
+
+
+def rows_at_position(model, partition, order, position, using="default"):
+    """
+    Returns queryset of rows which are at given position (counted from 1)
+    of their partition ordered by order (field names, '-' for descending).
+    Partitions with no more rows than position are skipped.
+    Requires window functions (connection.features.supports_over_clause).
+    """
+    opts = model._meta
+
+    def column(name):
+        return connections[using].ops.quote_name(opts.get_field(name).column)
+
+    ordering = ", ".join(
+        f"{column(name[1:])} DESC" if name.startswith("-") else column(name)
+        for name in order
+    )
+    window = f"OVER (PARTITION BY {column(partition)} ORDER BY {ordering})"
+    pk = column(opts.pk.name)
+    sql = (
+        f"SELECT {pk} FROM (SELECT {pk}, ROW_NUMBER() {window} AS position,"
+        f" COUNT(*) OVER (PARTITION BY {column(partition)}) AS total"
+        f" FROM {opts.db_table}) r WHERE position = %s AND total > %s"
+    )
+    return model.objects.using(using).filter(pk__in=RawSQL(sql, [position, position]))
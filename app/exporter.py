@@ -0,0 +1,220 @@
+"""
+Streaming export of users, tags, entries, votes and notifications.
+
+Rows are read with QuerySet.iterator(chunk_size=EXPORT_CHUNK_SIZE) and turned
+into lines one at a time, so memory use doesn't grow with the number of rows.
+On PostgreSQL this relies on server-side cursors, with
+DISABLE_SERVER_SIDE_CURSORS the driver reads whole result sets at once.
+
+JSON lines exports use the record format of app.importer (with ids of this
+database), so exports without notifications can be imported with
+import_jsonl. Password hashes aren't exported. CSV exports contain one kind
+of rows, lists (observers and blacklisters of tags) are space separated ids.
+
+Exports for a user (data portability requests) contain the user, tags they
+authored, observe or blacklist, their entries, their votes on them and
+notifications sent to them. They only refer to entries of the user, so
+other users' content isn't exported: replies to other users' entries have
+no parent (and are imported as discussions) and votes on other users'
+entries are left out.
+"""
+import csv
+import itertools
+import json
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Case, IntegerField, Q, When
+
+from .models import Entry, Notification, Tag, User
+
+# Kind: (record type, fields)
+KINDS = {
+    "users": ("user", ("id", "username", "email", "display_name", "date_joined")),
+    "tags": ("tag", ("name", "author", "observers", "blacklisters")),
+    "entries": (
+        "entry",
+        ("id", "user", "parent", "content", "created_date", "modified_date", "deleted"),
+    ),
+    "votes": ("vote", ("entry", "user", "value")),
+    "notifications": (
+        "notification",
+        (
+            "id",
+            "target",
+            "sender",
+            "notification_type",
+            "object_type",
+            "object_id",
+            "content",
+            "read",
+            "created_date",
+            "actors_count",
+        ),
+    ),
+}
+FORMATS = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+
+
+class InvalidExport(ValueError):
+    pass
+
+
+def iterate(queryset, fields):
+    """
+    Yields rows of queryset as dicts with fields (names of values_list columns)
+    """
+    for row in queryset.values_list(*fields.values()).iterator(
+        chunk_size=settings.EXPORT_CHUNK_SIZE
+    ):
+        yield dict(zip(fields, row))
+
+
+def user_rows(user=None):
+    users = User.objects.order_by("pk")
+    if user is not None:
+        users = users.filter(pk=user.pk)
+    fields = {name: name for name in KINDS["users"][1]}
+    fields["id"] = "pk"
+    return iterate(users, fields)
+
+
+class RelatedIds:
+    """
+    Ids of users related to tags, read from (tag name, user id) rows ordered
+    like tags. Every tag of the rows has to be asked for, in order.
+    """
+
+    def __init__(self, rows):
+        self.groups = itertools.groupby(rows, key=itemgetter(0))
+        self.advance()
+
+    def advance(self):
+        self.name, group = next(self.groups, (None, ()))
+        self.ids = [user for _, user in group]
+
+    def get(self, name):
+        # Names are only compared for equality, ordering is up to the database
+        if name != self.name:
+            return []
+        ids = self.ids
+        self.advance()
+        return ids
+
+
+def tag_rows(user=None):
+    tags = Tag.objects.order_by("name")
+    related = {}
+    for field in ("observers", "blacklisters"):
+        rows = getattr(Tag, field).through.objects.order_by("tag", "user")
+        if user is not None:
+            rows = rows.filter(user=user)
+        related[field] = RelatedIds(
+            rows.values_list("tag", "user").iterator(
+                chunk_size=settings.EXPORT_CHUNK_SIZE
+            )
+        )
+    if user is not None:
+        tags = tags.filter(
+            Q(author=user) | Q(observers=user) | Q(blacklisters=user)
+        ).distinct()
+    for row in iterate(tags, {"name": "name", "author": "author"}):
+        row["observers"] = related["observers"].get(row["name"])
+        row["blacklisters"] = related["blacklisters"].get(row["name"])
+        yield row
+
+
+def entry_rows(user=None):
+    # Parents come before their replies, as the importer expects
+    entries = Entry.objects.order_by("tree_id", "lft")
+    fields = {name: name for name in KINDS["entries"][1]}
+    fields["id"] = "pk"
+    if user is not None:
+        entries = entries.filter(user=user).annotate(
+            own_parent=Case(
+                When(parent__user=user, then="parent"), output_field=IntegerField()
+            )
+        )
+        fields["parent"] = "own_parent"
+    return iterate(entries, fields)
+
+
+def vote_rows(user=None):
+    for field, value in (("upvotes", 1), ("downvotes", -1)):
+        votes = getattr(Entry, field).through.objects.order_by("pk")
+        if user is not None:
+            votes = votes.filter(user=user, entry__user=user)
+        for row in iterate(votes, {"entry": "entry", "user": "user"}):
+            row["value"] = value
+            yield row
+
+
+def notification_rows(user=None):
+    notifications = Notification.objects.order_by("pk")
+    if user is not None:
+        notifications = notifications.filter(target=user)
+    fields = {name: name for name in KINDS["notifications"][1]}
+    fields.update(
+        id="pk", notification_type="type", object_type="object_content_type__model"
+    )
+    return iterate(notifications, fields)
+
+
+ROWS = {
+    "users": user_rows,
+    "tags": tag_rows,
+    "entries": entry_rows,
+    "votes": vote_rows,
+    "notifications": notification_rows,
+}
+
+
+def jsonl_lines(kinds, user):
+    for kind in kinds:
+        record_type = KINDS[kind][0]
+        for row in ROWS[kind](user):
+            yield json.dumps({"type": record_type, **row}, cls=DjangoJSONEncoder) + "\n"
+
+
+class Echo:
+    """
+    File-like object returning what is written, so csv.writer makes lines
+    """
+
+    def write(self, value):
+        return value
+
+
+def csv_value(value):
+    if isinstance(value, list):
+        return " ".join(str(item) for item in value)
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    return value
+
+
+def csv_lines(kind, user):
+    writer = csv.writer(Echo())
+    fields = KINDS[kind][1]
+    yield writer.writerow(fields)
+    for row in ROWS[kind](user):
+        yield writer.writerow([csv_value(row[field]) for field in fields])
+
+
+def export(kinds=None, format="jsonl", user=None):
+    """
+    Returns an iterator of lines exporting kinds of rows (all of them by
+    default) in format (jsonl or csv), only ones of user if given
+    """
+    kinds = list(kinds or KINDS)
+    unknown = [kind for kind in kinds if kind not in KINDS]
+    if unknown:
+        raise InvalidExport(f"Unknown kinds: {', '.join(unknown)}")
+    if format == "jsonl":
+        return jsonl_lines(kinds, user)
+    if format == "csv":
+        if len(kinds) != 1:
+            raise InvalidExport("CSV exports contain exactly one kind of rows")
+        return csv_lines(kinds[0], user)
+    raise InvalidExport(f"Unknown format: {format}")
@@ -0,0 +1,328 @@
+"""
+Bulk import of users, tags, entries and votes from JSON lines.
+
+Every line is a record with a type, ids are references within the imported
+data and records may only refer to earlier ones:
+    {"type": "user", "id": "u1", "username": "alice", "email": "a@example.com",
+     "display_name": "Alice", "password": "<hash>", "date_joined": "<iso>"}
+    {"type": "tag", "name": "python", "author": "u1", "observers": ["u1"],
+     "blacklisters": []}
+    {"type": "entry", "id": "e1", "user": "u1", "parent": null,
+     "content": "Hello #python", "created_date": "<iso>"}
+    {"type": "vote", "entry": "e1", "user": "u1", "value": 1}
+Users with usernames which already exist are reused. Users without
+a password hash can't log in until they reset their password.
+
+Records are read in batches of IMPORT_BATCH_SIZE and saved with bulk_create
+instead of Entry.save: content is formatted in a process pool, ids and tree
+ids are assigned up front and MPTT fields of imported discussions are
+rebuilt once they are complete, then discussions are renumbered so roots
+stay ordered newest first. Tags of entries are linked (with is_root and
+created_date of entries) and counted in TagUsage for entries recent enough
+to be trending. Search index is rebuilt at the end. Imported entries don't
+notify anyone and aren't added to timelines.
+
+Every batch is saved in a transaction. When a record is invalid, batches
+before it stay imported (and are finished like complete imports) and the
+rest of the file isn't imported.
+
+Imports must not run concurrently with anything else creating users
+or entries, as ids are assigned by the importer.
+"""
+import json
+from collections import Counter, defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.models import Max
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import Entry, EntryTag, Tag, TagUsage, User, rebuild_trees
+from .pagecache import invalidate_pages
+from .search import get_backend
+
+RECORD_TYPES = ("user", "tag", "entry", "vote")
+VOTE_FIELDS = {1: "upvotes", -1: "downvotes"}
+
+
+class InvalidRecord(ValueError):
+    pass
+
+
+def render_content(content):
+    """
+    Returns content cleaned and formatted like Entry.save does
+    """
+    entry = Entry(content=content)
+    entry.format_content()
+    return entry.content, entry.content_formatted
+
+
+def renumber_trees():
+    """
+    Gives discussions tree ids in the order of MPTTMeta.order_insertion_by
+    (newest roots first), which root_nodes() and Entry.save rely on.
+    Imported trees get ids in file order, so they are renumbered
+    together with existing ones they interleave with.
+    """
+    roots = list(
+        Entry.objects.filter(parent=None)
+        .order_by("-created_date", "tree_id")
+        .values_list("tree_id", flat=True)
+    )
+    changes = [(new, old) for new, old in enumerate(roots, 1) if new != old]
+    if not changes:
+        return
+    table = Entry._meta.db_table
+    # Ids are moved above all existing ones first, so trees never share an id
+    offset = max(roots)
+    with connection.cursor() as c:
+        c.executemany(
+            f"UPDATE {table} SET tree_id = %s WHERE tree_id = %s",
+            [(new + offset, old) for new, old in changes],
+        )
+        c.execute(
+            f"UPDATE {table} SET tree_id = tree_id - %s WHERE tree_id > %s",
+            [offset, offset],
+        )
+
+
+class Importer:
+    """
+    Imports records of JSON lines (see module docstring)
+
+    ::pool    - multiprocessing pool formatting content (None formats in process)
+    ::users   - ids of users by their ids in imported data
+    ::entries - (id, tree id) of entries by their ids in imported data
+    ::trees   - tree ids of imported discussions
+    ::usage   - number of uses of tags by (hour, tag name)
+    ::counts  - number of imported records by type
+    """
+
+    def __init__(self, pool=None, batch_size=None):
+        self.pool = pool
+        self.batch_size = batch_size or settings.IMPORT_BATCH_SIZE
+        self.users = {}
+        self.entries = {}
+        self.trees = []
+        self.usage = Counter()
+        self.counts = Counter()
+        self.next_user = (User.objects.aggregate(pk=Max("pk"))["pk"] or 0) + 1
+        self.next_entry = (Entry.objects.aggregate(pk=Max("pk"))["pk"] or 0) + 1
+        self.next_tree = (Entry.objects.aggregate(tree=Max("tree_id"))["tree"] or 0) + 1
+        self.trending_since = timezone.now() - timedelta(
+            days=settings.TRENDING_TAGS_BASELINE_DAYS
+        )
+
+    def run(self, lines):
+        """
+        Imports records of lines (any iterable of strings).
+        Returns number of imported records by type.
+        """
+        batch = []
+        try:
+            for number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    batch.append((number, json.loads(line)))
+                except ValueError as e:
+                    raise InvalidRecord(f"Line {number}: {e}")
+                if len(batch) >= self.batch_size:
+                    self.import_batch(batch)
+                    batch = []
+            if batch:
+                self.import_batch(batch)
+        finally:
+            # Batches imported before an error are committed and have to be
+            # finished too
+            self.finish()
+        return self.counts
+
+    def import_batch(self, batch):
+        records = defaultdict(list)
+        for number, record in batch:
+            if record.get("type") not in RECORD_TYPES:
+                raise InvalidRecord(f"Line {number}: unknown type {record.get('type')}")
+            records[record["type"]].append((number, record))
+        trees, usage = len(self.trees), self.usage.copy()
+        try:
+            with transaction.atomic():
+                self.import_users(records["user"])
+                self.import_tags(records["tag"])
+                self.import_entries(records["entry"])
+                self.import_votes(records["vote"])
+        except Exception:
+            # Trees and tag usage of the rolled back batch aren't finished
+            del self.trees[trees:]
+            self.usage = usage
+            raise
+
+    def field(self, number, record, name):
+        if record.get(name) is None:
+            raise InvalidRecord(f"Line {number}: missing {name}")
+        return record[name]
+
+    def date(self, number, record, name):
+        if record.get(name) is None:
+            return timezone.now()
+        date = parse_datetime(record[name])
+        if date is None:
+            raise InvalidRecord(f"Line {number}: invalid {name}")
+        if timezone.is_naive(date):
+            date = timezone.make_aware(date, timezone.utc)
+        return date
+
+    def user(self, number, record, name="user"):
+        key = self.field(number, record, name)
+        return self.reference(number, self.users, key, name)
+
+    def reference(self, number, references, key, name):
+        try:
+            return references[key]
+        except (KeyError, TypeError):
+            raise InvalidRecord(f"Line {number}: unknown {name} {key}")
+
+    def import_users(self, records):
+        usernames = [record.get("username") for _, record in records]
+        existing = dict(
+            User.objects.filter(username__in=usernames).values_list("username", "pk")
+        )
+        users = []
+        for number, record in records:
+            username = self.field(number, record, "username")
+            if username not in existing:
+                users.append(
+                    User(
+                        pk=self.next_user,
+                        username=username,
+                        email=self.field(number, record, "email"),
+                        display_name=record.get("display_name") or username,
+                        password=record.get("password") or make_password(None),
+                        date_joined=self.date(number, record, "date_joined"),
+                    )
+                )
+                existing[username] = self.next_user
+                self.next_user += 1
+            self.users[self.field(number, record, "id")] = existing[username]
+        User.objects.bulk_create(users)
+        self.counts["users"] += len(users)
+
+    def import_tags(self, records):
+        tags, relations = [], defaultdict(list)
+        for number, record in records:
+            name = self.field(number, record, "name").lower()
+            author = None
+            if record.get("author") is not None:
+                author = self.user(number, record, "author")
+            tags.append(Tag(name=name, author_id=author))
+            for field in ("observers", "blacklisters"):
+                through = getattr(Tag, field).through
+                relations[through].extend(
+                    through(
+                        tag_id=name,
+                        user_id=self.reference(number, self.users, user, field),
+                    )
+                    for user in record.get(field, [])
+                )
+        Tag.objects.bulk_create(tags, ignore_conflicts=True)
+        for through, rows in relations.items():
+            through.objects.bulk_create(rows, ignore_conflicts=True)
+        Tag.objects.clear_cached([tag.name for tag in tags])
+        self.counts["tags"] += len(tags)
+
+    def import_entries(self, records):
+        contents = [self.field(number, record, "content") for number, record in records]
+        if self.pool is not None:
+            rendered = self.pool.map(render_content, contents, chunksize=100)
+        else:
+            rendered = map(render_content, contents)
+        entries, links, upvotes = [], [], []
+        for (number, record), (content, formatted) in zip(records, rendered):
+            if record.get("parent") is None:
+                parent, tree = None, self.next_tree
+                self.next_tree += 1
+                self.trees.append(tree)
+            else:
+                parent, tree = self.reference(
+                    number, self.entries, record["parent"], "parent"
+                )
+            entry = Entry(
+                pk=self.next_entry,
+                user_id=self.user(number, record),
+                parent_id=parent,
+                content=content,
+                content_formatted=formatted,
+                created_date=self.date(number, record, "created_date"),
+                tree_id=tree,
+                lft=0,
+                rght=0,
+                level=0,
+            )
+            self.next_entry += 1
+            self.entries[self.field(number, record, "id")] = (entry.pk, tree)
+            entries.append(entry)
+            # Authors upvote their entries, like in Entry.save
+            upvotes.append(
+                Entry.upvotes.through(entry_id=entry.pk, user_id=entry.user_id)
+            )
+            links.extend(
+                EntryTag(
+                    entry_id=entry.pk,
+                    tag_id=name,
+                    is_root=parent is None,
+                    created_date=entry.created_date,
+                )
+                for name in entry.get_tags
+            )
+            if entry.created_date >= self.trending_since:
+                hour = entry.created_date.replace(minute=0, second=0, microsecond=0)
+                self.usage.update((hour, name) for name in entry.get_tags)
+        Entry.objects.bulk_create(entries)
+        tag_names = {link.tag_id for link in links}
+        Tag.objects.bulk_create(
+            [Tag(name=name) for name in tag_names], ignore_conflicts=True
+        )
+        Tag.objects.clear_cached(tag_names)
+        EntryTag.objects.bulk_create(links)
+        Entry.upvotes.through.objects.bulk_create(upvotes, ignore_conflicts=True)
+        self.counts["entries"] += len(entries)
+
+    def import_votes(self, records):
+        votes = defaultdict(list)
+        for number, record in records:
+            field = VOTE_FIELDS.get(record.get("value"))
+            if field is None:
+                raise InvalidRecord(f"Line {number}: vote value must be 1 or -1")
+            entry, _ = self.reference(
+                number, self.entries, record.get("entry"), "entry"
+            )
+            through = getattr(Entry, field).through
+            votes[through].append(
+                through(entry_id=entry, user_id=self.user(number, record))
+            )
+        for through, rows in votes.items():
+            through.objects.bulk_create(rows, ignore_conflicts=True)
+        self.counts["votes"] += len(records)
+
+    def finish(self):
+        with transaction.atomic():
+            rebuild_trees(self.trees, self.batch_size)
+            if self.trees:
+                renumber_trees()
+            # Usage is recorded with one query per hour and number of uses
+            tag_names = defaultdict(list)
+            for (hour, name), count in self.usage.items():
+                tag_names[hour, count].append(name)
+            for (hour, count), names in tag_names.items():
+                TagUsage.objects.record(names, hour, count)
+            # Ids were assigned by the importer, sequences have to catch up
+            with connection.cursor() as c:
+                for sql in connection.ops.sequence_reset_sql(no_style(), [User, Entry]):
+                    c.execute(sql)
+            get_backend().rebuild()
+        invalidate_pages()
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.archive import archive_deleted_entries
+
+
+class Command(BaseCommand):
+    help = (
+        "Moves deleted entries older than DELETED_ENTRY_RETENTION_DAYS "
+        "from db to compressed archive files"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.DELETED_ENTRY_ARCHIVE_BATCH_SIZE,
+            help="Number of records archived and deleted at once.",
+        )
+
+    def handle(self, *args, **options):
+        archived = archive_deleted_entries(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Archived {archived} deleted entries"))
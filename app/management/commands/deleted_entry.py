@@ -0,0 +1,24 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.archive import find_deleted_entry, restore_deleted_entry
+
+
+class Command(BaseCommand):
+    help = "Looks up a deleted entry in db and archive files by its old id"
+
+    def add_arguments(self, parser):
+        parser.add_argument("old_id", type=int, help="Id of the deleted entry.")
+        parser.add_argument(
+            "--restore", action="store_true", help="Copy archived record back to db.",
+        )
+
+    def handle(self, *args, **options):
+        record = find_deleted_entry(options["old_id"])
+        if record is None:
+            raise CommandError(f"Deleted entry {options['old_id']} not found")
+        self.stdout.write(json.dumps(record, indent=2))
+        if options["restore"]:
+            restore_deleted_entry(options["old_id"])
+            self.stdout.write(self.style.SUCCESS("Restored to db"))
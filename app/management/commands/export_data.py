@@ -0,0 +1,54 @@
+import gzip
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.exporter import FORMATS, KINDS, InvalidExport, export
+from app.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Exports users, tags, entries, votes and notifications as JSON lines "
+        "or CSV (see app/exporter.py)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="File to write, gzipped if it ends with .gz, - for stdout.",
+        )
+        parser.add_argument("--format", choices=list(FORMATS), default="jsonl")
+        parser.add_argument(
+            "--kinds",
+            nargs="+",
+            choices=list(KINDS),
+            help="Kinds of rows to export, all of them by default.",
+        )
+        parser.add_argument(
+            "--user", help="Export only data of the user with this username."
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options["user"]:
+            try:
+                user = User.objects.get(username=options["user"])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+        try:
+            lines = export(options["kinds"], options["format"], user)
+        except InvalidExport as e:
+            raise CommandError(e)
+        path = options["output"]
+        if path == "-":
+            for line in lines:
+                self.stdout.write(line, ending="")
+            return
+        opener = gzip.open if path.endswith(".gz") else open
+        count = 0
+        with opener(path, "wt", newline="") as f:
+            for line in lines:
+                f.write(line)
+                count += 1
+        self.stdout.write(self.style.SUCCESS(f"Exported {count} lines to {path}"))
@@ -0,0 +1,63 @@
+import gzip
+import multiprocessing
+import os
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from app.importer import Importer, InvalidRecord
+
+
+class Command(BaseCommand):
+    help = (
+        "Imports users, tags, entries and votes from a JSON lines file "
+        "(see app/importer.py for the format)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "path", help="JSON lines file, gzipped if it ends with .gz, - for stdin."
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.IMPORT_BATCH_SIZE,
+            help="Number of records read and saved at once.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=os.cpu_count(),
+            help="Number of processes formatting content (0 formats in this process).",
+        )
+
+    def handle(self, *args, **options):
+        path = options["path"]
+        if path == "-":
+            lines = sys.stdin
+        elif path.endswith(".gz"):
+            lines = gzip.open(path, "rt")
+        else:
+            lines = open(path)
+        pool = None
+        if options["workers"]:
+            # Workers must not share connections of this process
+            connections.close_all()
+            pool = multiprocessing.Pool(options["workers"])
+        try:
+            counts = Importer(pool, options["batch_size"]).run(lines)
+        except InvalidRecord as e:
+            raise CommandError(e)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+            lines.close()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Imported {counts['users']} users, {counts['tags']} tags,"
+                f" {counts['entries']} entries and {counts['votes']} votes"
+            )
+        )
@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from app.notifications import prune_notifications
+
+
+class Command(BaseCommand):
+    help = (
+        "Deletes read notifications older than NOTIFICATION_RETENTION_DAYS "
+        "and notifications exceeding NOTIFICATION_MAX_PER_USER per user"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.NOTIFICATION_PRUNE_BATCH_SIZE,
+            help="Range of ids deleted at once.",
+        )
+
+    def handle(self, *args, **options):
+        deleted = prune_notifications(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} notifications"))
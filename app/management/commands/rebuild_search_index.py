@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from app.search import get_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuilds full-text search index of entries"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database to rebuild the index in. Defaults to the 'default' database.",
+        )
+
+    def handle(self, *args, **options):
+        backend = get_backend(options["database"])
+        with transaction.atomic(using=options["database"]):
+            backend.create_index()
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
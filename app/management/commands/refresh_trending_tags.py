@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from app.trending import compact_tag_usage, refresh_trending_tags
+
+
+class Command(BaseCommand):
+    help = (
+        "Compacts old hourly tag usage buckets into daily ones "
+        "and refreshes cached snapshot of trending tags"
+    )
+
+    def handle(self, *args, **options):
+        compacted = compact_tag_usage()
+        trending = refresh_trending_tags()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Compacted {compacted} hourly buckets, {len(trending)} tags are trending"
+            )
+        )
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from app.sqlite import checkpoint
+
+
+class Command(BaseCommand):
+    help = "Checkpoints SQLite WAL file and runs PRAGMA optimize"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--database",
+            default=DEFAULT_DB_ALIAS,
+            help="Database to maintain. Defaults to the 'default' database.",
+        )
+        parser.add_argument(
+            "--mode",
+            default="TRUNCATE",
+            choices=["PASSIVE", "FULL", "RESTART", "TRUNCATE"],
+            help="WAL checkpoint mode. Defaults to TRUNCATE.",
+        )
+
+    def handle(self, *args, **options):
+        connection = connections[options["database"]]
+        if connection.vendor != "sqlite":
+            raise CommandError("Database is not SQLite")
+        busy, log, checkpointed = checkpoint(connection, options["mode"])
+        if busy:
+            self.stdout.write(
+                self.style.WARNING("Checkpoint didn't finish, database is busy")
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checkpointed {checkpointed} of {log} WAL frames, database optimized"
+            )
+        )
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from app.timeline import trim_timelines
+
+
+class Command(BaseCommand):
+    help = "Deletes the oldest entries of timelines longer than TIMELINE_MAX_ENTRIES"
+
+    def handle(self, *args, **options):
+        deleted = trim_timelines()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} timeline entries"))
@@ -0,0 +1,260 @@
+"""
+Prometheus metrics.
+
+Metrics are counters and histograms defined in METRICS. Histograms are kept
+as cumulative counters of their buckets, sum and count, so every sample of
+every metric only grows and samples of many processes can be summed.
+
+Every process (e.g. gunicorn worker) keeps its samples in memory and writes
+them to its own file in METRICS_DIR after a request if the last write is
+older than METRICS_FLUSH_SECONDS, and when it exits. The /metrics view
+(MetricsView in app.views) sums files of all processes, including ones
+which have exited, so counters never go back. METRICS_DIR should be emptied
+when the whole application is restarted. Without METRICS_DIR samples are
+only kept in memory and every process serves its own.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+RENDER_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+FANOUT_BUCKETS = (0, 1, 10, 100, 1000, 10000, 100000)
+
+# Name: (type, help, buckets of histograms)
+METRICS = {
+    "bloggy_http_request_duration_seconds": (
+        "histogram",
+        "Latency of requests by view and method",
+        LATENCY_BUCKETS,
+    ),
+    "bloggy_db_queries_total": ("counter", "Database queries by view", None),
+    "bloggy_entries_created_total": ("counter", "Entries created", None),
+    "bloggy_votes_total": ("counter", "Votes cast by direction", None),
+    "bloggy_notification_fanout_size": (
+        "histogram",
+        "Users notified about tags of a new entry",
+        FANOUT_BUCKETS,
+    ),
+    "bloggy_markdown_render_seconds": (
+        "histogram",
+        "Formatting of entry content (Entry.format_content)",
+        RENDER_BUCKETS,
+    ),
+    "bloggy_cache_requests_total": (
+        "counter",
+        "Cache lookups by cache and result (hit or miss)",
+        None,
+    ),
+}
+CACHE_HIT_RATIO = "bloggy_cache_hit_ratio"
+
+
+class Registry:
+    """
+    Samples of metrics of this process
+
+    ::samples    - value of every (sample name, labels) pair
+    ::pid        - process which samples belong to, forked processes start over
+    ::last_flush - time.monotonic() of the last write to METRICS_DIR
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.samples = defaultdict(float)
+        self.last_flush = 0
+
+    def path(self):
+        return os.path.join(settings.METRICS_DIR, f"{os.getpid()}.json")
+
+    def check_process(self):
+        if self.pid == os.getpid():
+            return
+        # A process with reused pid continues samples of the old one
+        self.pid = os.getpid()
+        self.samples = defaultdict(
+            float, read_samples(self.path()) if settings.METRICS_DIR else {}
+        )
+        self.last_flush = time.monotonic()
+
+    def inc(self, name, value=1, labels=()):
+        with self.lock:
+            self.check_process()
+            self.samples[name, labels] += value
+
+    def observe(self, name, value, labels=()):
+        buckets = METRICS[name][2]
+        with self.lock:
+            self.check_process()
+            # Empty buckets are kept too, Prometheus expects all of them
+            for bucket in buckets:
+                key = (f"{name}_bucket", labels + (("le", bucket),))
+                self.samples[key] += 1 if value <= bucket else 0
+            self.samples[f"{name}_bucket", labels + (("le", "+Inf"),)] += 1
+            self.samples[f"{name}_sum", labels] += value
+            self.samples[f"{name}_count", labels] += 1
+
+    def flush(self, force=False):
+        """
+        Writes samples to METRICS_DIR if METRICS_FLUSH_SECONDS have passed
+        """
+        with self.lock:
+            if self.pid != os.getpid() or not settings.METRICS_DIR:
+                return
+            if not force and (
+                time.monotonic() - self.last_flush < settings.METRICS_FLUSH_SECONDS
+            ):
+                return
+            self.last_flush = time.monotonic()
+            data = [
+                [name, list(labels), value]
+                for (name, labels), value in self.samples.items()
+            ]
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = self.path()
+        with open(path + ".tmp", "w") as f:
+            json.dump(data, f)
+        os.replace(path + ".tmp", path)
+
+
+registry = Registry()
+atexit.register(registry.flush, force=True)
+
+
+def inc(name, value=1, **labels):
+    registry.inc(name, value, tuple(sorted(labels.items())))
+
+
+def observe(name, value, **labels):
+    registry.observe(name, value, tuple(sorted(labels.items())))
+
+
+@contextmanager
+def timed(name, **labels):
+    """
+    Observes duration of the block in seconds
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+class QueryCounter:
+    """
+    Database execute wrapper counting queries
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def cache_lookup(cache_name, value):
+    """
+    Counts a lookup of cache_name as a hit if value isn't None, returns value
+    """
+    result = "miss" if value is None else "hit"
+    inc("bloggy_cache_requests_total", cache=cache_name, result=result)
+    return value
+
+
+def read_samples(path):
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {
+        (name, tuple(tuple(label) for label in labels)): value
+        for name, labels, value in data
+    }
+
+
+def collect():
+    """
+    Returns samples of all processes summed up
+    """
+    if not settings.METRICS_DIR:
+        with registry.lock:
+            registry.check_process()
+            return defaultdict(float, registry.samples)
+    registry.flush(force=True)
+    samples = defaultdict(float)
+    if not os.path.isdir(settings.METRICS_DIR):
+        return samples
+    for filename in os.listdir(settings.METRICS_DIR):
+        if filename.endswith(".json"):
+            path = os.path.join(settings.METRICS_DIR, filename)
+            for key, value in read_samples(path).items():
+                samples[key] += value
+    return samples
+
+
+def format_sample(name, labels, value):
+    if labels:
+        pairs = ",".join(
+            '{}="{}"'.format(key, str(label).replace("\\", r"\\").replace('"', r"\""))
+            for key, label in labels
+        )
+        name = f"{name}{{{pairs}}}"
+    if float(value).is_integer():
+        value = int(value)
+    return f"{name} {value}"
+
+
+def render():
+    """
+    Returns metrics of all processes in Prometheus text format
+    """
+    samples = collect()
+    lines = []
+    for name, (kind, description, _) in METRICS.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        names = (
+            {f"{name}_bucket", f"{name}_sum", f"{name}_count"}
+            if kind == "histogram"
+            else {name}
+        )
+        for sample_name, labels in sorted(
+            (key for key in samples if key[0] in names), key=sample_order
+        ):
+            lines.append(
+                format_sample(sample_name, labels, samples[sample_name, labels])
+            )
+    # Ratios are computed here as counters of all processes are known
+    lookups = defaultdict(lambda: {"hit": 0, "miss": 0})
+    for (sample_name, labels), value in samples.items():
+        if sample_name == "bloggy_cache_requests_total":
+            labels = dict(labels)
+            lookups[labels["cache"]][labels["result"]] += value
+    lines.append(f"# HELP {CACHE_HIT_RATIO} Share of cache lookups which were hits")
+    lines.append(f"# TYPE {CACHE_HIT_RATIO} gauge")
+    for cache_name, counts in sorted(lookups.items()):
+        ratio = counts["hit"] / (counts["hit"] + counts["miss"])
+        lines.append(format_sample(CACHE_HIT_RATIO, (("cache", cache_name),), ratio))
+    return "\n".join(lines) + "\n"
+
+
+def sample_order(key):
+    # Buckets are ordered by their bounds, +Inf is the last one
+    name, labels = key
+    bounds = [
+        float("inf") if value == "+Inf" else value
+        for label, value in labels
+        if label == "le"
+    ]
+    other = [label for label in labels if label[0] != "le"]
+    return (other, name, bounds)
@@ -0,0 +1,183 @@
+"""
+Middleware of bloggy.
+"""
+import json
+import logging
+import os
+import random
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics
+from .database import Routing, routing
+from .profiling import is_requested, profile_request
+from .querylog import Origin, origin, query_wrapper, view_name
+from .timing import RequestTimer, record_query, timer
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PIN_COOKIE = "use_primary"
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+# Other methods are counted together, so clients can't add labels to metrics
+METRICS_METHODS = SAFE_METHODS + ("POST", "PUT", "PATCH", "DELETE")
+
+
+class ReplicaMiddleware:
+    """
+    Routes reads of safe requests to read replicas (see app.database).
+    Clients which wrote to the primary get a cookie which pins them
+    to the primary for REPLICA_PIN_SECONDS.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def is_pinned(self, request):
+        try:
+            return float(request.COOKIES[REPLICA_PIN_COOKIE]) > time.time()
+        except (KeyError, ValueError):
+            return False
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        state = Routing(
+            use_replicas=request.method in SAFE_METHODS and not self.is_pinned(request)
+        )
+        token = routing.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            routing.reset(token)
+        if state.written or request.method not in SAFE_METHODS:
+            response.set_cookie(
+                REPLICA_PIN_COOKIE,
+                str(time.time() + settings.REPLICA_PIN_SECONDS),
+                max_age=settings.REPLICA_PIN_SECONDS,
+                httponly=True,
+            )
+        return response
+
+
+class TimingMiddleware:
+    """
+    Measures total, SQL, template and serializer time of a sample of requests
+    (REQUEST_TIMING_SAMPLE_RATE, see app.timing). Timings are sent to clients
+    in a Server-Timing header and logged as one JSON line.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.REQUEST_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        current = RequestTimer()
+        token = timer.set(current)
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(record_query))
+                response = self.get_response(request)
+        finally:
+            timer.reset(token)
+        total = current.total()
+        response["Server-Timing"] = self.server_timing(current, total)
+        logger.info(json.dumps(self.log_record(request, response, current, total)))
+        return response
+
+    def server_timing(self, current, total):
+        metrics = [
+            f'db;dur={current.durations["db"] * 1000:.1f};'
+            f'desc="{current.counts["db"]} queries"',
+            f'template;dur={current.durations["template"] * 1000:.1f}',
+            f'serializer;dur={current.durations["serializer"] * 1000:.1f}',
+            f"total;dur={total * 1000:.1f}",
+        ]
+        return ", ".join(metrics)
+
+    def log_record(self, request, response, current, total):
+        match = request.resolver_match
+        return {
+            "method": request.method,
+            "path": request.path,
+            "view": match.view_name if match else None,
+            "status": response.status_code,
+            "total_ms": round(total * 1000, 1),
+            "db_ms": round(current.durations["db"] * 1000, 1),
+            "db_queries": current.counts["db"],
+            "template_ms": round(current.durations["template"] * 1000, 1),
+            "serializer_ms": round(current.durations["serializer"] * 1000, 1),
+        }
+
+
+class SlowQueryMiddleware:
+    """
+    Logs slow queries of requests and tags queries with the view which
+    made them (SLOW_QUERY_LOG_MS and SQL_ORIGIN_COMMENTS, see app.querylog)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if settings.SLOW_QUERY_LOG_MS is None and not settings.SQL_ORIGIN_COMMENTS:
+            return self.get_response(request)
+        token = origin.set(Origin(view_name(request)))
+        try:
+            with ExitStack() as stack:
+                for connection in connections.all():
+                    stack.enter_context(connection.execute_wrapper(query_wrapper))
+                return self.get_response(request)
+        finally:
+            origin.reset(token)
+
+
+class ProfilingMiddleware:
+    """
+    Runs requests of staff users which ask for it under cProfile and
+    tracemalloc (see app.profiling). The name of the written summary is sent
+    in X-Profile header.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not is_requested(request) or not request.user.is_staff:
+            return self.get_response(request)
+        response, path = profile_request(self.get_response, request)
+        response["X-Profile"] = os.path.basename(path)
+        return response
+
+
+class MetricsMiddleware:
+    """
+    Records latency and number of queries of requests by view (see app.metrics)
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = metrics.QueryCounter()
+        start = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(counter))
+            response = self.get_response(request)
+        match = request.resolver_match
+        view = match.view_name if match else "-"
+        method = request.method if request.method in METRICS_METHODS else "other"
+        metrics.observe(
+            "bloggy_http_request_duration_seconds",
+            time.perf_counter() - start,
+            view=view,
+            method=method,
+        )
+        metrics.inc("bloggy_db_queries_total", counter.count, view=view)
+        metrics.registry.flush()
+        return response
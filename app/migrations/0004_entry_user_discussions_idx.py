@@ -0,0 +1,18 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0003_auto_20190207_1858"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="entry",
+            index=models.Index(
+                fields=["user", "tree_id", "created_date"],
+                name="entry_user_discussions_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.db import migrations
+
+from app.search import get_backend
+
+
+def create_search_index(apps, schema_editor):
+    backend = get_backend(schema_editor.connection.alias)
+    backend.create_index()
+    backend.rebuild()
+
+
+def drop_search_index(apps, schema_editor):
+    get_backend(schema_editor.connection.alias).drop_index()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0004_entry_user_discussions_idx"),
+    ]
+
+    operations = [migrations.RunPython(create_search_index, drop_search_index)]
@@ -0,0 +1,53 @@
+# Generated by Django 2.2.9 on 2026-10-19 09:37
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0005_entry_search_index"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TagUsage",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "period",
+                    models.CharField(
+                        choices=[("hour", "Hour"), ("day", "Day")],
+                        default="hour",
+                        max_length=4,
+                    ),
+                ),
+                ("bucket", models.DateTimeField()),
+                ("count", models.PositiveIntegerField(default=0)),
+                (
+                    "tag",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="usage",
+                        to="app.Tag",
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="tagusage",
+            index=models.Index(fields=["bucket"], name="tagusage_bucket_idx"),
+        ),
+        migrations.AlterUniqueTogether(
+            name="tagusage", unique_together={("tag", "period", "bucket")},
+        ),
+    ]
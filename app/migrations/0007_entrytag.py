@@ -0,0 +1,88 @@
+# Generated by Django 2.2.9 on 2026-10-19 09:52
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_entry_data(apps, schema_editor):
+    Entry = apps.get_model("app", "Entry")
+    EntryTag = apps.get_model("app", "EntryTag")
+    EntryTag.objects.filter(entry__parent=None).update(is_root=True)
+    EntryTag.objects.update(
+        created_date=Subquery(
+            Entry.objects.filter(pk=OuterRef("entry")).values("created_date")[:1]
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0006_tagusage"),
+    ]
+
+    operations = [
+        # Existing auto-created 'app_entry_tags' table becomes the through model
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name="EntryTag",
+                    fields=[
+                        (
+                            "id",
+                            models.AutoField(
+                                auto_created=True,
+                                primary_key=True,
+                                serialize=False,
+                                verbose_name="ID",
+                            ),
+                        ),
+                        (
+                            "entry",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="app.Entry",
+                            ),
+                        ),
+                        (
+                            "tag",
+                            models.ForeignKey(
+                                on_delete=django.db.models.deletion.CASCADE,
+                                to="app.Tag",
+                            ),
+                        ),
+                    ],
+                    options={
+                        "db_table": "app_entry_tags",
+                        "unique_together": {("entry", "tag")},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name="entry",
+                    name="tags",
+                    field=models.ManyToManyField(
+                        blank=True, through="app.EntryTag", to="app.Tag"
+                    ),
+                ),
+            ]
+        ),
+        migrations.AddField(
+            model_name="entrytag",
+            name="is_root",
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name="entrytag",
+            name="created_date",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(copy_entry_data, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="entrytag",
+            index=models.Index(
+                fields=["tag", "is_root", "-created_date"], name="entrytag_feed_idx"
+            ),
+        ),
+    ]
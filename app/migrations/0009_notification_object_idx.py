@@ -0,0 +1,20 @@
+# Generated by Django 2.2.9 on 2026-10-19 09:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0008_timelineentry"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                fields=["object_content_type", "object_id"],
+                name="notification_object_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 2.2.9 on 2026-10-19 09:46
+
+import json
+
+from django.db import migrations, models
+
+
+def pack_voters(apps, schema_editor):
+    # Voters were stored as str() of a list of ints which is valid JSON already
+    DeletedEntry = apps.get_model("app", "DeletedEntry")
+    to_update = []
+    for deleted in DeletedEntry.objects.only("upvoters", "downvoters").iterator():
+        for field in ["upvoters", "downvoters"]:
+            ids = json.loads(getattr(deleted, field) or "[]")
+            setattr(deleted, field, json.dumps(ids, separators=(",", ":")))
+        to_update.append(deleted)
+    DeletedEntry.objects.bulk_update(to_update, ["upvoters", "downvoters"], 1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0009_notification_object_idx"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="deletedentry",
+            name="old_id",
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.RunPython(pack_voters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 2.2.9 on 2026-10-19 09:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0010_deletedentry_compact_voters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notification",
+            name="actors_count",
+            field=models.PositiveIntegerField(default=1),
+        ),
+        migrations.AlterField(
+            model_name="notification",
+            name="object_id",
+            field=models.CharField(max_length=255),
+        ),
+    ]
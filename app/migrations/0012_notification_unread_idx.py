@@ -0,0 +1,21 @@
+# Generated by Django 2.2.9 on 2026-10-19 09:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0011_notification_coalescing"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="notification",
+            index=models.Index(
+                condition=models.Q(read=False),
+                fields=["target", "type", "object_content_type", "object_id"],
+                name="notification_unread_idx",
+            ),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 2.2.9 on 2026-10-19 10:52
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def add_senders(apps, schema_editor):
+    # Earlier actors of unread notifications are unknown, their last one is kept
+    Notification = apps.get_model("app", "Notification")
+    NotificationActor = apps.get_model("app", "NotificationActor")
+    unread = Notification.objects.filter(read=False).values_list("pk", "sender")
+    NotificationActor.objects.bulk_create(
+        NotificationActor(notification_id=pk, user_id=sender)
+        for pk, sender in unread.iterator()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0012_notification_unread_idx"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NotificationActor",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "notification",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="actors",
+                        to="app.Notification",
+                    ),
+                ),
+                (
+                    "user",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+            options={"unique_together": {("notification", "user")}},
+        ),
+        migrations.RunPython(add_senders, migrations.RunPython.noop),
+    ]
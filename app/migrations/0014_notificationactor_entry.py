@@ -0,0 +1,28 @@
+# Generated by Django 2.2.9 on 2026-10-19 11:06
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0013_notificationactor"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="notificationactor",
+            name="entry",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="+",
+                to="app.Entry",
+            ),
+        ),
+        migrations.AlterUniqueTogether(
+            name="notificationactor",
+            unique_together={("notification", "user", "entry")},
+        ),
+    ]
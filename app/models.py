@@ -1,4 +1,7 @@
+import json
 import re
+import threading
+from collections import defaultdict
 
 import bleach
 import markdown
@@ -6,12 +9,26 @@
 from django.contrib.auth.models import AbstractUser
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
+from django.core.cache import cache
+from django.db import connection, connections, models
+from django.db.models import Count, Exists, F, OuterRef, Prefetch, Q, Subquery
+from django.db.models.functions import Coalesce
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.functional import cached_property
 from django.utils.html import format_html
+from mptt.managers import TreeManager
 from mptt.models import MPTTModel, TreeForeignKey
+from mptt.querysets import TreeQuerySet
+
+from . import metrics
+from .pagecache import invalidate_pages
+from .search import get_backend
+
+DELETED_CONTENT = "<p><em>deleted</em></p>"
+BULK_DELETE_BATCH_SIZE = 500
+
+formatters = threading.local()
 
 
 class User(AbstractUser):
@@ -30,14 +47,11 @@ def points(self):
         """
         Returns user points by a formula count_of_entries + upvotes_from_entries - downvotes_from_entries
         """
-        user_entries = Entry.objects.filter(user=self.pk)
-        aggregations = user_entries.aggregate(
-            models.Count("upvotes"), models.Count("downvotes")
-        )
         return (
-            user_entries.count()
-            + aggregations["upvotes__count"]
-            - aggregations["downvotes__count"]
+            User.objects.filter(pk=self.pk)
+            .annotate(points=user_points())
+            .values_list("points", flat=True)
+            .get()
         )
 
     @cached_property
@@ -46,13 +60,70 @@ def notifications_unread_count(self):
 
     @cached_property
     def notifications(self):
-        return Notification.objects.filter(target=self).order_by("-id")[:5]
+        return (
+            Notification.objects.filter(target=self)
+            .select_related("sender")
+            .prefetch_related("object")[:5]
+        )
 
     @cached_property
     def private_messages_unread_count(self):
         return PrivateMessage.objects.filter(target=self).filter(read=False).count()
 
 
+class TagManager(models.Manager):
+    def get_cached(self, name):
+        """
+        Returns a tag with given name (None if it doesn't exist).
+        Both existing and missing tags are cached so looking up tags is read-only
+        and doesn't hit the database most of the time.
+        """
+        tag = metrics.cache_lookup("tag", cache.get(self.cache_key(name)))
+        if tag is None:
+            tag = self.filter(name=name).first() or False
+            cache.set(self.cache_key(name), tag, settings.TAG_CACHE_TIMEOUT)
+        return tag or None
+
+    def clear_cached(self, names):
+        cache.delete_many([self.cache_key(name) for name in names])
+
+    def cache_key(self, name):
+        return f"tag:{name}"
+
+    def blacklisted_by(self, user):
+        """
+        Returns cached list of names of tags blacklisted by user
+        """
+        names = metrics.cache_lookup(
+            "blacklist", cache.get(self.blacklist_cache_key(user))
+        )
+        if names is None:
+            names = list(self.filter(blacklisters=user).values_list("name", flat=True))
+            cache.set(self.blacklist_cache_key(user), names, settings.TAG_CACHE_TIMEOUT)
+        return names
+
+    def clear_blacklisted_by(self, user):
+        cache.delete(self.blacklist_cache_key(user))
+
+    def blacklist_cache_key(self, user):
+        return f"blacklist:{user.pk}"
+
+    def with_api_data(self, user):
+        """
+        Annotates data needed to serialize tags
+        ::observers_count  - number of observers
+        ::user_observes    - true if user observes a tag
+        ::user_blacklisted - true if user blacklisted a tag
+        """
+        observers = Tag.observers.through.objects.filter(tag=OuterRef("pk"))
+        blacklisters = Tag.blacklisters.through.objects.filter(tag=OuterRef("pk"))
+        return self.annotate(
+            observers_count=subquery_count(observers, field="tag"),
+            user_observes=Exists(observers.filter(user=user.pk)),
+            user_blacklisted=Exists(blacklisters.filter(user=user.pk)),
+        )
+
+
 class Tag(models.Model):
     """
     Generic tag class
@@ -74,20 +145,126 @@ class Tag(models.Model):
         settings.AUTH_USER_MODEL, related_name="blacklisters", blank=True
     )
 
+    objects = TagManager()
+
     def __str__(self):
         return "#" + self.name
 
 
+class TagUsageManager(models.Manager):
+    def record(self, tag_names, date, count=1):
+        """
+        Increments hourly usage counters of tags in a bucket containing date
+        by count
+        """
+        bucket = date.replace(minute=0, second=0, microsecond=0)
+        connection = connections[self.db]
+        if connection.vendor == "postgresql":
+            # Counters are created or incremented with a single upsert
+            if not tag_names:
+                return
+            table = self.model._meta.db_table
+            rows = ", ".join(["(%s, %s, %s, %s)"] * len(tag_names))
+            with connection.cursor() as c:
+                c.execute(
+                    f"INSERT INTO {table} (tag_id, period, bucket, count) VALUES {rows}"
+                    " ON CONFLICT (tag_id, period, bucket)"
+                    f" DO UPDATE SET count = {table}.count + EXCLUDED.count",
+                    [
+                        param
+                        for name in tag_names
+                        for param in (name, self.model.HOUR, bucket, count)
+                    ],
+                )
+            return
+        self.bulk_create(
+            [self.model(tag_id=name, bucket=bucket) for name in tag_names],
+            ignore_conflicts=True,
+        )
+        self.filter(tag__in=tag_names, period=self.model.HOUR, bucket=bucket).update(
+            count=F("count") + count
+        )
+
+
+class TagUsage(models.Model):
+    """
+    Counts how many times a tag was used in a time bucket.
+    Old hourly buckets are compacted into daily ones.
+
+    ::tag    - used tag
+    ::period - length of a bucket (hour or day)
+    ::bucket - datetime when the bucket starts
+    ::count  - how many times tag was used in the bucket
+    """
+
+    HOUR = "hour"
+    DAY = "day"
+    PERIOD_CHOICES = ((HOUR, "Hour"), (DAY, "Day"))
+
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name="usage")
+    period = models.CharField(max_length=4, choices=PERIOD_CHOICES, default=HOUR)
+    bucket = models.DateTimeField()
+    count = models.PositiveIntegerField(default=0)
+
+    objects = TagUsageManager()
+
+    class Meta:
+        unique_together = ("tag", "period", "bucket")
+        indexes = [models.Index(fields=["bucket"], name="tagusage_bucket_idx")]
+
+
+class NotificationManager(models.Manager):
+    def notify(self, type, sender, object, targets, content=None, entry=None):
+        """
+        Notifies targets (users or their ids) about an event caused by entry.
+        Unread notifications of the same type and object are coalesced:
+        they are updated in place (sender becomes the last actor) instead of
+        creating a new notification per event.
+        """
+        target_ids = {getattr(target, "pk", target) for target in targets}
+        if not target_ids:
+            return
+        unread = self.filter(
+            type=type,
+            object_content_type=ContentType.objects.get_for_model(object),
+            object_id=object.pk,
+            target__in=target_ids,
+            read=False,
+        )
+        coalesced = set(unread.values_list("target", flat=True))
+        self.bulk_create(
+            [
+                self.model(
+                    type=type,
+                    sender=sender,
+                    object=object,
+                    target_id=target_id,
+                    content=content,
+                )
+                for target_id in target_ids - coalesced
+            ]
+        )
+        NotificationActor.objects.add(unread, sender.pk, getattr(entry, "pk", None))
+        if coalesced:
+            unread.filter(target__in=coalesced).update(
+                actors_count=actors_count(),
+                sender=sender,
+                content=content,
+                created_date=timezone.now(),
+            )
+
+
 class Notification(models.Model):
     """
     Generic notification class
 
-    ::type    - describes the type of notification to be later used in templates
-    ::sender  - user who is responsible for making the notification
-    ::object  - context object
-    ::target  - target user who will be notified
-    ::content - text to display (optional)
-    ::read    - logic if notification has been read
+    ::type         - describes the type of notification to be later used in templates
+    ::sender       - user who is responsible for making the notification (the last actor)
+    ::object       - context object
+    ::target       - target user who will be notified
+    ::content      - text to display (optional)
+    ::read         - logic if notification has been read
+    ::actors_count - number of users whose events were coalesced into this notification
     """
 
     type = models.CharField(
@@ -98,7 +275,8 @@ class Notification(models.Model):
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="sender"
     )
     object_content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
-    object_id = models.PositiveIntegerField()
+    # Text so notifications can point to tags (which use names as primary keys)
+    object_id = models.CharField(max_length=255)
     object = GenericForeignKey("object_content_type", "object_id")
     target = models.ForeignKey(
         settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="target"
@@ -106,9 +284,91 @@ class Notification(models.Model):
     content = models.TextField(blank=True, null=True)
     read = models.BooleanField(default=False)
     created_date = models.DateTimeField(auto_now=True)
+    actors_count = models.PositiveIntegerField(default=1)
+
+    objects = NotificationManager()
 
     class Meta:
         ordering = ["-created_date"]
+        indexes = [
+            models.Index(
+                fields=["object_content_type", "object_id"],
+                name="notification_object_idx",
+            ),
+            # Unread notifications are counted and coalesced per target
+            models.Index(
+                fields=["target", "type", "object_content_type", "object_id"],
+                name="notification_unread_idx",
+                condition=Q(read=False),
+            ),
+        ]
+
+
+class NotificationActorManager(models.Manager):
+    def add(self, notifications, user_id, entry_id):
+        """
+        Adds an event of a user (caused by an entry) to notifications
+        (a queryset) with a single INSERT ... SELECT, events which are
+        already stored are skipped
+        """
+        connection = connections[self.db]
+        ops = connection.ops
+        sql, params = notifications.values("pk").query.sql_with_params()
+        with connection.cursor() as c:
+            c.execute(
+                f"{ops.insert_statement(ignore_conflicts=True)}"
+                f" {self.model._meta.db_table} (notification_id, user_id, entry_id)"
+                f" SELECT n.id, %s, %s FROM ({sql}) n"
+                f" {ops.ignore_conflicts_suffix_sql(ignore_conflicts=True)}",
+                [user_id, entry_id] + list(params),
+            )
+
+
+class NotificationActor(models.Model):
+    """
+    Event coalesced into a notification. Actors are counted once however
+    many events they cause, and events of deleted entries can be taken
+    back out of notifications (see retract_notifications).
+
+    ::notification - notification of the event
+    ::user         - user who caused the event
+    ::entry        - entry which caused the event (unknown for events
+                     coalesced before entries were stored)
+    """
+
+    notification = models.ForeignKey(
+        Notification, on_delete=models.CASCADE, related_name="actors"
+    )
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+"
+    )
+    entry = models.ForeignKey(
+        "Entry", null=True, on_delete=models.CASCADE, related_name="+"
+    )
+
+    objects = NotificationActorManager()
+
+    class Meta:
+        unique_together = ("notification", "user", "entry")
+
+
+def actors_count(actors=None):
+    """
+    Expression counting distinct actors of notifications
+    (among actors, all of them by default)
+    """
+    if actors is None:
+        actors = NotificationActor.objects.filter(notification=OuterRef("pk"))
+    return Coalesce(
+        Subquery(
+            actors.order_by()
+            .values("notification")
+            .annotate(count=Count("user", distinct=True))
+            .values("count"),
+            output_field=models.IntegerField(),
+        ),
+        0,
+    )
 
 
 class PrivateMessage(models.Model):
@@ -140,18 +400,20 @@ def save(self, *args, **kwargs):
 class DeletedEntry(models.Model):
     """
     Model to store data of deleted Entry.
+    Records older than DELETED_ENTRY_RETENTION_DAYS are moved to archive files
+    by 'python manage.py archive_deleted_entries'.
 
     ::old_id     - id of deleted entry
     ::user       - id of author of deleted entry
     ::parent     - id parent entry
     ::content    - nonformatted content but cleaned with bleach
-    ::upvoters   - users who upvoted deleted entry
-    ::downvoters - users who downvoted deleted entry
+    ::upvoters   - ids of users who upvoted deleted entry (JSON list)
+    ::downvoters - ids of users who downvoted deleted entry (JSON list)
     ::created_on - datetime of creation
     ::deleted_on - datetime of deletion
     """
 
-    old_id = models.IntegerField()
+    old_id = models.IntegerField(db_index=True)
     user = models.IntegerField()
     parent = models.IntegerField(blank=True, null=True)
     content = models.TextField()
@@ -160,6 +422,271 @@ class DeletedEntry(models.Model):
     created_on = models.DateTimeField()
     deleted_on = models.DateTimeField(auto_now_add=True)
 
+    @staticmethod
+    def dump_ids(ids):
+        return json.dumps(list(ids), separators=(",", ":"))
+
+    @property
+    def upvoter_ids(self):
+        return json.loads(self.upvoters or "[]")
+
+    @property
+    def downvoter_ids(self):
+        return json.loads(self.downvoters or "[]")
+
+
+class EntryQuerySet(TreeQuerySet):
+    def with_tree_data(self, user=None):
+        """
+        Selects authors and annotates votes needed to render entries in templates
+        so rendering a tree doesn't issue any queries per node.
+        ::votes_sum      - substract of downvotes from upvotes
+        ::user_upvoted   - true if user upvoted an entry (only for authenticated user)
+        ::user_downvoted - true if user downvoted an entry (only for authenticated user)
+        """
+        upvotes = Entry.upvotes.through.objects.filter(entry=OuterRef("pk"))
+        downvotes = Entry.downvotes.through.objects.filter(entry=OuterRef("pk"))
+        queryset = self.select_related("user").annotate(
+            votes_sum=subquery_count(upvotes) - subquery_count(downvotes)
+        )
+        if user is not None and user.is_authenticated:
+            queryset = queryset.annotate(
+                user_upvoted=Exists(upvotes.filter(user=user.pk)),
+                user_downvoted=Exists(downvotes.filter(user=user.pk)),
+            )
+        return queryset
+
+    def with_api_data(self, user=None):
+        """
+        Selects authors, prefetches tags and annotates votes needed
+        to serialize entries so serializing a page doesn't issue queries per entry.
+        ::upvotes_count   - number of upvotes
+        ::downvotes_count - number of downvotes
+        ::user_upvoted    - true if user upvoted an entry (only for authenticated user)
+        ::user_downvoted  - true if user downvoted an entry (only for authenticated user)
+        """
+        upvotes = Entry.upvotes.through.objects.filter(entry=OuterRef("pk"))
+        downvotes = Entry.downvotes.through.objects.filter(entry=OuterRef("pk"))
+        queryset = (
+            self.select_related("user")
+            .prefetch_related(Prefetch("tags", queryset=Tag.objects.only("pk")))
+            .annotate(
+                upvotes_count=subquery_count(upvotes),
+                downvotes_count=subquery_count(downvotes),
+            )
+        )
+        if user is not None and user.is_authenticated:
+            queryset = queryset.annotate(
+                user_upvoted=Exists(upvotes.filter(user=user.pk)),
+                user_downvoted=Exists(downvotes.filter(user=user.pk)),
+            )
+        return queryset
+
+    def archive(self):
+        """
+        Stores entries which aren't deleted yet as DeletedEntry objects
+        and deletes their notifications (and takes their events out of
+        coalesced ones), tags, timeline and search index rows.
+        Entries themselves are left untouched. Returns ids of archived entries.
+        """
+        entries = list(
+            self.filter(deleted=False).values_list(
+                "pk", "parent", "user", "content", "created_date"
+            )
+        )
+        pks = [entry[0] for entry in entries]
+        if not pks:
+            return pks
+        voters = {"upvotes": defaultdict(list), "downvotes": defaultdict(list)}
+        for field, users in voters.items():
+            through = getattr(Entry, field).through
+            for entry_id, user_id in through.objects.filter(entry__in=pks).values_list(
+                "entry", "user"
+            ):
+                users[entry_id].append(user_id)
+        DeletedEntry.objects.bulk_create(
+            [
+                DeletedEntry(
+                    old_id=pk,
+                    parent=parent,
+                    user=user,
+                    content=content,
+                    upvoters=DeletedEntry.dump_ids(voters["upvotes"][pk]),
+                    downvoters=DeletedEntry.dump_ids(voters["downvotes"][pk]),
+                    created_on=created_date,
+                )
+                for pk, parent, user, content, created_date in entries
+            ]
+        )
+        Notification.objects.filter(
+            object_content_type=ContentType.objects.get_for_model(Entry),
+            object_id__in=pks,
+        ).delete()
+        # Circular import, notifications need models
+        from .notifications import retract_notifications
+
+        retract_notifications(pks)
+        EntryTag.objects.filter(entry__in=pks).delete()
+        TimelineEntry.objects.filter(entry__in=pks).delete()
+        get_backend().remove_entries(pks)
+        return pks
+
+    def soft_delete(self):
+        """
+        Deletes many entries (e.g. all entries of a spammer) with a bounded number
+        of set-based queries per batch of BULK_DELETE_BATCH_SIZE entries.
+        Entries are archived and marked as deleted, then (like Entry.delete does)
+        deleted entries without replies which aren't deleted are removed from db
+        together with their replies.
+        Returns number of deleted entries.
+        """
+        entries = list(self.filter(deleted=False).values_list("pk", "tree_id"))
+        for start in range(0, len(entries), BULK_DELETE_BATCH_SIZE):
+            batch = entries[start : start + BULK_DELETE_BATCH_SIZE]
+            pks = Entry.objects.filter(pk__in=[pk for pk, _ in batch]).archive()
+            Entry.objects.filter(pk__in=pks).update(
+                deleted=True,
+                content=DELETED_CONTENT,
+                content_formatted=DELETED_CONTENT,
+                modified_date=timezone.now(),
+            )
+            invalidate_pages()
+            # Like Entry.delete, deleted entries are only kept as long as they
+            # have replies which aren't deleted
+            live = Entry.objects.filter(
+                tree_id=OuterRef("tree_id"),
+                lft__gt=OuterRef("lft"),
+                rght__lt=OuterRef("rght"),
+                deleted=False,
+            )
+            dead = list(
+                Entry.objects.filter(
+                    tree_id__in={tree_id for _, tree_id in batch}, deleted=True
+                )
+                .annotate(alive=Exists(live))
+                .filter(alive=False)
+                .values_list("pk", "tree_id")
+            )
+            if dead:
+                Entry.objects.filter(pk__in=[pk for pk, _ in dead]).delete()
+                # Remaining discussions are renumbered to close gaps in MPTT fields
+                rebuild_trees(
+                    list(
+                        Entry.objects.filter(
+                            tree_id__in={tree_id for _, tree_id in dead}, parent=None
+                        ).values_list("tree_id", flat=True)
+                    )
+                )
+        return len(entries)
+
+
+def rebuild_trees(tree_ids, batch_size=None):
+    """
+    Sets MPTT fields (lft, rght, level) of entries of trees with given ids from
+    their parent links. Does what Entry.objects.partial_rebuild does with one
+    query reading a batch of trees and a prepared UPDATE executed for all of
+    their entries instead of two queries per entry.
+    """
+    batch_size = batch_size or BULK_DELETE_BATCH_SIZE
+    sql = (
+        f"UPDATE {Entry._meta.db_table} SET lft = %s, rght = %s, level = %s"
+        " WHERE id = %s"
+    )
+    for start in range(0, len(tree_ids), batch_size):
+        children = defaultdict(list)
+        # Siblings are ordered like MPTTMeta.order_insertion_by
+        for pk, parent in (
+            Entry.objects.filter(tree_id__in=tree_ids[start : start + batch_size])
+            .order_by("-created_date", "pk")
+            .values_list("pk", "parent")
+        ):
+            children[parent].append(pk)
+        nodes = []
+        for root in children[None]:
+            # Depth first without recursion, discussions can be very deep
+            position = 1
+            stack = [(root, 1, 0, iter(children[root]))]
+            while stack:
+                pk, left, level, remaining = stack[-1]
+                child = next(remaining, None)
+                position += 1
+                if child is None:
+                    nodes.append((left, position, level, pk))
+                    stack.pop()
+                else:
+                    stack.append((child, position, level + 1, iter(children[child])))
+        with connection.cursor() as c:
+            c.executemany(sql, nodes)
+
+
+def subquery_count(queryset, field="entry"):
+    """
+    Turns a queryset filtered by OuterRef("pk") on field into a COUNT subquery.
+    Unlike Count over joins it doesn't multiply rows when combined with other counts.
+    """
+    return Coalesce(
+        Subquery(
+            queryset.order_by()
+            .values(field)
+            .annotate(count=Count("pk"))
+            .values("count"),
+            output_field=models.IntegerField(),
+        ),
+        0,
+    )
+
+
+def user_points():
+    """
+    Expression computing points of users (see User.points) with subqueries,
+    so users can be annotated and ordered by points in a single query.
+    """
+    user = OuterRef("pk")
+    return (
+        subquery_count(Entry.objects.filter(user=user), field="user")
+        + subquery_count(
+            Entry.upvotes.through.objects.filter(entry__user=user), field="entry__user"
+        )
+        - subquery_count(
+            Entry.downvotes.through.objects.filter(entry__user=user),
+            field="entry__user",
+        )
+    )
+
+
+def get_formatters():
+    """
+    Returns markdown converter and bleach cleaner of the current thread.
+    They are reused because creating them (loading extensions, building
+    parsers) takes longer than formatting most entries and neither of them
+    is thread-safe.
+    """
+    if not hasattr(formatters, "converter"):
+        formatters.converter = markdown.Markdown(extensions=["extra"])
+        formatters.cleaner = bleach.Cleaner(
+            settings.MARKDOWN_TAGS, settings.MARKDOWN_ATTRS
+        )
+    return formatters.converter, formatters.cleaner
+
+
+def cache_root_users(nodes):
+    """
+    Sets 'root_user_pk' on every node using roots which are already loaded.
+    Roots missing from nodes are fetched with a single query.
+    Returns nodes to allow chaining.
+    """
+    root_users = {node.tree_id: node.user_id for node in nodes if node.is_root_node()}
+    missing_trees = {node.tree_id for node in nodes} - set(root_users)
+    if missing_trees:
+        root_users.update(
+            Entry.objects.filter(tree_id__in=missing_trees, parent=None).values_list(
+                "tree_id", "user_id"
+            )
+        )
+    for node in nodes:
+        node.root_user_pk = root_users[node.tree_id]
+    return nodes
+
 
 class Entry(MPTTModel):
     """
@@ -194,13 +721,22 @@ class Entry(MPTTModel):
     created_date = models.DateTimeField(default=timezone.now)
     modified_date = models.DateTimeField(blank=True, null=True)
     deleted = models.BooleanField(default=False)
-    tags = models.ManyToManyField(Tag, blank=True)
+    tags = models.ManyToManyField(Tag, blank=True, through="EntryTag")
+
+    objects = TreeManager.from_queryset(EntryQuerySet)()
 
     class MPTTMeta:
         order_insertion_by = ["-created_date"]
 
     class Meta:
         verbose_name_plural = "Entries"
+        indexes = [
+            # Covers looking up discussions user participated in
+            models.Index(
+                fields=["user", "tree_id", "created_date"],
+                name="entry_user_discussions_idx",
+            )
+        ]
 
     def __str__(self):
         if len(self.content) > 45:
@@ -229,68 +765,79 @@ def format_content(self):
             p, r'\1<a href="/users/\3">@\3</a>', self.content_formatted
         )
         # Clean and format content
-        self.content_formatted = bleach.clean(
-            markdown.markdown(self.content_formatted, extensions=["extra"]),
-            settings.MARKDOWN_TAGS,
-            settings.MARKDOWN_ATTRS,
-        )
-        self.content = bleach.clean(
-            self.content, settings.MARKDOWN_TAGS, settings.MARKDOWN_ATTRS
+        converter, cleaner = get_formatters()
+        self.content_formatted = cleaner.clean(
+            converter.reset().convert(self.content_formatted)
         )
+        self.content = cleaner.clean(self.content)
 
     def save(self, *args, **kwargs):
         """
         Custom save method:
-        - Adds tags to self.tags field
+        - Adds tags to self.tags field and counts their usage
         - Notifies tag observers about new entry
         - Formats and cleans content
+        - Updates full-text search index
         """
         created = True if not self.pk else False
         # If entry is being modified, update the modified date field
         if not created:
             self.modified_date = timezone.now()
         # Format the content before saving
-        self.format_content()
+        with metrics.timed("bloggy_markdown_render_seconds"):
+            self.format_content()
         # Call save before accessing tags field to avoid errors
         super().save(*args, **kwargs)
         # By default, entry is upvoted by it's author when it's first created
         if created:
             self.upvotes.add(self.user)
-        # Clear tags so if user deletes a tag from content it won't appear.
-        self.tags.clear()
-        tags_to_add = [
-            Tag.objects.get_or_create(name=tag_name)[0] for tag_name in self.get_tags
-        ]
-        self.tags.add(*tags_to_add)
+        # Sync tags with content so if user deletes a tag from content it won't appear.
+        tag_names = set(self.get_tags)
+        current_tags = (
+            set() if created else set(self.tags.values_list("name", flat=True))
+        )
+        if current_tags - tag_names:
+            self.tags.remove(*(current_tags - tag_names))
+        added_tags = tag_names - current_tags
+        if added_tags:
+            Tag.objects.bulk_create(
+                [Tag(name=tag_name) for tag_name in added_tags], ignore_conflicts=True
+            )
+            Tag.objects.clear_cached(added_tags)
+            self.tags.add(
+                *added_tags,
+                through_defaults={
+                    "is_root": self.is_root_node(),
+                    "created_date": self.created_date,
+                },
+            )
+            TagUsage.objects.record(added_tags, self.modified_date or self.created_date)
+        get_backend().index_entry(self)
 
     def delete(self, *args, **kwargs):
         """
         On delete mark the entry as deleted, don't delete from db.
+        Only columns of a deleted entry are updated so content isn't formatted
+        and tags aren't synced again. Entries without children are deleted from db.
         """
-        # Delete notifications related to an entry
-        Notification.objects.filter(object_id=self.pk).delete()
-        # Create a DeletedEntry object to store data about original entry
+        # Store data about original entry, delete its notifications and tags
         if not self.deleted:
-            self.create_deleted_entry()
+            Entry.objects.filter(pk=self.pk).archive()
         if self.has_children:
             self.deleted = True
-            self.content = "<p><em>deleted</em></p>"
-            self.content_formatted = "<p><em>deleted</em></p>"
-            self.save()
+            self.content = DELETED_CONTENT
+            self.content_formatted = DELETED_CONTENT
+            self.modified_date = timezone.now()
+            Entry.objects.filter(pk=self.pk).update(
+                deleted=self.deleted,
+                content=self.content,
+                content_formatted=self.content_formatted,
+                modified_date=self.modified_date,
+            )
+            invalidate_pages()
         else:
             super().delete(*args, **kwargs)
 
-    def create_deleted_entry(self):
-        DeletedEntry.objects.create(
-            old_id=self.pk,
-            parent=self.parent.pk if self.parent else None,
-            user=self.user.pk,
-            content=self.content,
-            upvoters=str([user.id for user in self.upvotes.all()]),
-            downvoters=str([user.id for user in self.downvotes.all()]),
-            created_on=self.created_date,
-        )
-
     @cached_property
     def votes_sum(self):
         """
@@ -305,6 +852,15 @@ def root_pk(self):
         """
         return self.get_root().pk
 
+    @cached_property
+    def root_user_pk(self):
+        """
+        Returns id of the author of root node
+        """
+        if self.is_root_node():
+            return self.user_id
+        return self.get_root().user_id
+
     @cached_property
     def has_children(self):
         """
@@ -338,3 +894,53 @@ def user_formatted(self):
 
     parent_formatted.short_description = "Parent entry"
     user_formatted.short_description = "User"
+
+
+class EntryTag(models.Model):
+    """
+    Links an entry with a tag.
+    Root flag and creation date of an entry are copied so tag feeds
+    are read from a single (tag, is_root, created_date) index.
+
+    ::entry        - tagged entry
+    ::tag          - tag used in an entry
+    ::is_root      - true if entry is a root node
+    ::created_date - date of creation of an entry
+    """
+
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    is_root = models.BooleanField(default=False)
+    created_date = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        db_table = "app_entry_tags"
+        unique_together = ("entry", "tag")
+        indexes = [
+            models.Index(
+                fields=["tag", "is_root", "-created_date"], name="entrytag_feed_idx"
+            )
+        ]
+
+
+class TimelineEntry(models.Model):
+    """
+    Root entry with tags observed by a user. Rows are fanned out when entry is created.
+
+    ::user         - owner of the timeline
+    ::entry        - root entry with tags observed by user
+    ::created_date - date of creation of an entry (used for keyset pagination)
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline"
+    )
+    entry = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name="+")
+    created_date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["user", "-created_date", "-entry"], name="timeline_user_idx"
+            )
+        ]
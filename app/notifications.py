@@ -0,0 +1,217 @@
+"""
+Notification fan-out and retention.
+
+Observers of tags used in a new entry are notified with set-based queries:
+per tag and per range of NOTIFICATION_FANOUT_BATCH_SIZE observer ids, observers
+without an unread notification about the tag get one from a single
+INSERT ... SELECT, the author is added to actors of all of them with another
+one and a single UPDATE sets their sender, content and number of actors.
+Events of deleted entries are taken out of notifications again
+(see retract_notifications).
+
+Read notifications older than NOTIFICATION_RETENTION_DAYS are deleted
+and every user keeps at most NOTIFICATION_MAX_PER_USER newest notifications.
+The policy is enforced by 'python manage.py prune_notifications' which deletes
+rows in small id-ranged batches, so a write lock is never held for long.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.db.models import Count, Exists, Max, Min, OuterRef, Q, Subquery
+from django.urls import reverse
+from django.utils import timezone
+
+from .database import rows_at_position
+from .models import Entry, Notification, NotificationActor, Tag, actors_count
+
+
+def tag_used_content(entry, tag_name):
+    author_link = (
+        f'<a href="{reverse("user-detail-view", args=[entry.user.username])}">'
+        f"{entry.user.username}</a>"
+    )
+    entry_link = (
+        f'<a href="{reverse("entry-detail-view", args=[entry.pk])}">'
+        f'"{entry.content:.25}..."</a>'
+    )
+    return (
+        f'{author_link} used tag <a href="{reverse("tag", args=[tag_name])}">'
+        f"#{tag_name}</a> in {entry_link}"
+    )
+
+
+def fan_out_tag_notifications(entry, tag_names, batch_size=None):
+    """
+    Notifies observers of tags used in entry. The author, users who blacklisted
+    one of the tags and users notified about an earlier tag (tags are processed
+    in alphabetical order) are skipped. Observers are never loaded into Python.
+    Returns number of notified users.
+    """
+    batch_size = batch_size or settings.NOTIFICATION_FANOUT_BATCH_SIZE
+    tag_names = sorted(tag_names)
+    observers = Tag.observers.through.objects.exclude(user=entry.user_id).exclude(
+        user__in=Tag.blacklisters.through.objects.filter(tag__in=tag_names).values(
+            "user"
+        )
+    )
+    content_type = ContentType.objects.get_for_model(Tag)
+    now = timezone.now()
+    notified = 0
+    for position, tag_name in enumerate(tag_names):
+        content = tag_used_content(entry, tag_name)
+        tag_observers = observers.filter(tag=tag_name).exclude(
+            user__in=Tag.observers.through.objects.filter(
+                tag__in=tag_names[:position]
+            ).values("user")
+        )
+        unread = Notification.objects.filter(
+            type="tag_used",
+            object_content_type=content_type,
+            object_id=tag_name,
+            read=False,
+        )
+        bounds = tag_observers.aggregate(first=Min("user"), last=Max("user"))
+        if bounds["first"] is None:
+            continue
+        for start in range(bounds["first"], bounds["last"] + 1, batch_size):
+            targets = tag_observers.filter(
+                user__gte=start, user__lt=start + batch_size
+            ).values("user")
+            targets_sql, targets_params = targets.query.sql_with_params()
+            with connection.cursor() as c:
+                c.execute(
+                    f"INSERT INTO {Notification._meta.db_table} (type, sender_id,"
+                    " object_content_type_id, object_id, target_id, content, read,"
+                    " created_date, actors_count)"
+                    f" SELECT %s, %s, %s, %s, t.user_id, %s, %s, %s, 1 FROM ({targets_sql}) t"
+                    f" WHERE NOT EXISTS (SELECT 1 FROM {Notification._meta.db_table} n"
+                    " WHERE n.type = %s AND n.object_content_type_id = %s"
+                    " AND n.object_id = %s AND n.target_id = t.user_id AND n.read = %s)",
+                    [
+                        "tag_used",
+                        entry.user_id,
+                        content_type.pk,
+                        tag_name,
+                        content,
+                        False,
+                        connection.ops.adapt_datetimefield_value(now),
+                    ]
+                    + list(targets_params)
+                    + ["tag_used", content_type.pk, tag_name, False],
+                )
+            # New and coalesced notifications of the batch are counted once here
+            batch = unread.filter(target__in=targets)
+            NotificationActor.objects.add(batch, entry.user_id, entry.pk)
+            notified += batch.update(
+                actors_count=actors_count(),
+                sender=entry.user_id,
+                content=content,
+                created_date=now,
+            )
+    return notified
+
+
+def retract_notifications(entry_pks):
+    """
+    Takes events caused by entries with given ids out of notifications.
+    Notifications without other events are deleted, the rest are recounted
+    and get their last remaining event as sender (and content of tag_used
+    notifications). Updates are set-based, content is rendered once for
+    every tag and remaining entry.
+    """
+    retracted = NotificationActor.objects.filter(entry__in=entry_pks)
+    if not retracted.exists():
+        return
+    events = NotificationActor.objects.filter(notification=OuterRef("pk"))
+    remaining = events.exclude(entry__in=entry_pks)
+    last = remaining.order_by("-pk")
+    affected = Notification.objects.annotate(
+        retracted=Exists(events.filter(entry__in=entry_pks)),
+        remaining=Exists(remaining),
+    ).filter(retracted=True)
+    affected.filter(remaining=False).delete()
+    stale = Notification.objects.filter(
+        pk__in=affected.filter(remaining=True).values("pk")
+    )
+    tag_used = stale.filter(type="tag_used").annotate(
+        last_entry=Subquery(last.values("entry")[:1])
+    )
+    groups = tag_used.order_by().values_list("object_id", "last_entry").distinct()
+    entries = Entry.objects.select_related("user").in_bulk(
+        {entry_pk for _, entry_pk in groups if entry_pk is not None}
+    )
+    for tag_name, entry_pk in list(groups):
+        if entry_pk in entries:
+            Notification.objects.filter(
+                pk__in=tag_used.filter(object_id=tag_name, last_entry=entry_pk).values(
+                    "pk"
+                )
+            ).update(content=tag_used_content(entries[entry_pk], tag_name))
+    stale.update(
+        sender=Subquery(last.values("user")[:1]), actors_count=actors_count(remaining),
+    )
+    retracted.delete()
+
+
+def delete_in_batches(queryset, batch_size):
+    """
+    Deletes rows of queryset with a DELETE per range of batch_size ids.
+    Returns number of deleted rows.
+    """
+    bounds = queryset.aggregate(first=Min("pk"), last=Max("pk"))
+    if bounds["first"] is None:
+        return 0
+    deleted = 0
+    for start in range(bounds["first"], bounds["last"] + 1, batch_size):
+        count, _ = queryset.filter(pk__gte=start, pk__lt=start + batch_size).delete()
+        deleted += count
+    return deleted
+
+
+def prune_notifications(now=None, batch_size=None):
+    """
+    Deletes notifications which exceed the retention policy.
+    Returns number of deleted notifications.
+    """
+    now = now or timezone.now()
+    batch_size = batch_size or settings.NOTIFICATION_PRUNE_BATCH_SIZE
+    max_per_user = settings.NOTIFICATION_MAX_PER_USER
+    deleted = delete_in_batches(
+        Notification.objects.filter(
+            read=True,
+            created_date__lt=now - timedelta(days=settings.NOTIFICATION_RETENTION_DAYS),
+        ),
+        batch_size,
+    )
+    if connection.features.supports_over_clause:
+        # The last kept notification of every user is found with a single query
+        last_rows = rows_at_position(
+            Notification, "target", ["-created_date", "-id"], max_per_user
+        ).values_list("target", "created_date", "pk")
+    else:
+        # Clear default ordering, otherwise created_date is added to GROUP BY
+        too_many = (
+            Notification.objects.order_by()
+            .values("target")
+            .annotate(notifications_count=Count("id"))
+            .filter(notifications_count__gt=max_per_user)
+            .values_list("target", flat=True)
+        )
+        last_rows = (
+            (target_id,)
+            + Notification.objects.filter(target=target_id)
+            .order_by("-created_date", "-pk")
+            .values_list("created_date", "pk")[max_per_user - 1]
+            for target_id in too_many
+        )
+    for target_id, created_date, pk in last_rows:
+        deleted += delete_in_batches(
+            Notification.objects.filter(target=target_id).filter(
+                Q(created_date__lt=created_date)
+                | Q(created_date=created_date, pk__lt=pk)
+            ),
+            batch_size,
+        )
+    return deleted
@@ -0,0 +1,107 @@
+"""
+Cache of pages rendered for anonymous users.
+
+Pages are stored with the generation they were rendered in. Entry, vote and
+tag events bump the generation (see invalidate_pages) which makes all cached
+pages stale. Stale pages are served for up to PAGE_CACHE_STALE_TIMEOUT seconds
+while a single request (holding a lock) renders a fresh one, so expiry or
+invalidation never makes all visitors hit the database at once.
+
+CSRF tokens are per visitor, so they are replaced with a placeholder
+in cached content and a fresh token is put back on every response.
+"""
+import re
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.middleware.csrf import get_token
+
+from . import metrics
+
+GENERATION_CACHE_KEY = "page_generation"
+CSRF_TOKEN_PLACEHOLDER = b"__csrf_token__"
+CSRF_TOKEN_RE = re.compile(rb'(name="csrfmiddlewaretoken" value=")[^"]*(")')
+
+
+def invalidate_pages():
+    """
+    Marks all cached pages as stale
+    """
+    if not cache.add(GENERATION_CACHE_KEY, 1, None):
+        try:
+            cache.incr(GENERATION_CACHE_KEY)
+        except ValueError:
+            # Key expired (or was evicted) in the meantime
+            cache.set(GENERATION_CACHE_KEY, 1, None)
+
+
+def _render(view, request, *args, **kwargs):
+    response = view(request, *args, **kwargs)
+    if response.status_code != 200 or response.streaming:
+        return response, None
+    content = CSRF_TOKEN_RE.sub(
+        rb"\1" + CSRF_TOKEN_PLACEHOLDER + rb"\2", response.content
+    )
+    return response, (content, response["Content-Type"])
+
+
+def _respond(request, page):
+    content, content_type = page
+    if CSRF_TOKEN_PLACEHOLDER in content:
+        content = content.replace(CSRF_TOKEN_PLACEHOLDER, get_token(request).encode())
+    return HttpResponse(content, content_type=content_type)
+
+
+def cache_anonymous_page(view):
+    """
+    Decorator caching responses of GET requests made by anonymous users
+    """
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != "GET" or request.user.is_authenticated:
+            return view(request, *args, **kwargs)
+        key = f"page:{request.get_full_path()}"
+        lock_key = f"page-lock:{request.get_full_path()}"
+        deadline = time.monotonic() + settings.PAGE_CACHE_LOCK_TIMEOUT
+        while True:
+            cached = cache.get_many([key, GENERATION_CACHE_KEY])
+            entry, generation = cached.get(key), cached.get(GENERATION_CACHE_KEY)
+            if entry is not None:
+                page, rendered_at, rendered_generation = entry
+                fresh = (
+                    rendered_generation == generation
+                    and time.time() - rendered_at < settings.PAGE_CACHE_TIMEOUT
+                )
+                if fresh:
+                    metrics.inc(
+                        "bloggy_cache_requests_total", cache="page", result="hit"
+                    )
+                    return _respond(request, page)
+            if cache.add(lock_key, 1, settings.PAGE_CACHE_LOCK_TIMEOUT):
+                break
+            # Another request renders the page - serve the stale one
+            # or wait for a fresh one if there is nothing to serve
+            if entry is not None:
+                metrics.inc("bloggy_cache_requests_total", cache="page", result="hit")
+                return _respond(request, page)
+            if time.monotonic() > deadline:
+                return view(request, *args, **kwargs)
+            time.sleep(0.05)
+        metrics.inc("bloggy_cache_requests_total", cache="page", result="miss")
+        try:
+            response, page = _render(view, request, *args, **kwargs)
+            if page is not None:
+                cache.set(
+                    key,
+                    (page, time.time(), generation),
+                    settings.PAGE_CACHE_TIMEOUT + settings.PAGE_CACHE_STALE_TIMEOUT,
+                )
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
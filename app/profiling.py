@@ -0,0 +1,84 @@
+"""
+On-demand profiling of requests.
+
+Staff users can add ?profile=1 (or a 'X-Profile: 1' header) to a request to
+run it under cProfile and tracemalloc (see ProfilingMiddleware in
+app.middleware). Every profiled request writes to PROFILING_DIR:
+    <name>.prof       - cProfile stats, readable by pstats or snakeviz
+    <name>.tracemalloc - tracemalloc snapshot, readable by Snapshot.load
+    <name>.txt        - top PROFILING_TOP functions and allocation sites
+tracemalloc traces the whole process, so allocations of concurrent requests
+in other threads show up in the snapshot as well.
+"""
+import cProfile
+import io
+import os
+import pstats
+import re
+import tracemalloc
+
+from django.conf import settings
+from django.utils import timezone
+
+PROFILE_PARAMETER = "profile"
+PROFILE_HEADER = "HTTP_X_PROFILE"
+
+
+def is_requested(request):
+    """
+    Returns true if request asks to be profiled, doesn't check the user
+    """
+    return (
+        request.GET.get(PROFILE_PARAMETER) == "1"
+        or request.META.get(PROFILE_HEADER) == "1"
+    )
+
+
+def profile_name(request):
+    path = re.sub(r"[^\w]+", "-", request.path).strip("-") or "home"
+    return f"{timezone.now():%Y%m%d-%H%M%S-%f}-{request.method.lower()}-{path}"
+
+
+def summary(request, profile, snapshot):
+    stream = io.StringIO()
+    stream.write(f"{request.method} {request.get_full_path()}\n\n")
+    stats = pstats.Stats(profile, stream=stream)
+    stats.sort_stats("cumulative").print_stats(settings.PROFILING_TOP)
+    snapshot = snapshot.filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+    )
+    stream.write("Top allocation sites\n\n")
+    for statistic in snapshot.statistics("lineno")[: settings.PROFILING_TOP]:
+        stream.write(f"{statistic}\n")
+    return stream.getvalue()
+
+
+def profile_request(get_response, request):
+    """
+    Returns response of request handled under cProfile and tracemalloc
+    and path of the written summary
+    """
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start(settings.PROFILING_TRACEBACK_DEPTH)
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+        try:
+            response = get_response(request)
+        finally:
+            profile.disable()
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if started_tracing:
+            tracemalloc.stop()
+    os.makedirs(settings.PROFILING_DIR, exist_ok=True)
+    path = os.path.join(settings.PROFILING_DIR, profile_name(request))
+    profile.dump_stats(path + ".prof")
+    snapshot.dump(path + ".tracemalloc")
+    with open(path + ".txt", "w") as f:
+        f.write(summary(request, profile, snapshot))
+    return response, path + ".txt"
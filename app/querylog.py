@@ -0,0 +1,118 @@
+"""
+Slow query log.
+
+SlowQueryMiddleware (see app.middleware) installs query_wrapper on every
+connection while a request runs. Queries which take at least
+SLOW_QUERY_LOG_MS are logged as JSON lines with the view (and viewset
+action) which made them and the last SLOW_QUERY_STACK_DEPTH frames of bloggy
+code which led to them. With SLOW_QUERY_EXPLAIN the query plan of slow
+SELECTs is logged as well. With SQL_ORIGIN_COMMENTS every query starts with
+a /* view=... */ comment, so queries in database logs can be attributed.
+"""
+import json
+import logging
+import os
+import re
+import time
+import traceback
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+origin = ContextVar("origin", default=None)
+
+# Frames of these files are the same for every query
+IGNORED_FILES = {
+    os.path.join(os.path.dirname(__file__), name)
+    for name in ["querylog.py", "middleware.py", "timing.py", "metrics.py"]
+}
+
+
+class Origin:
+    """
+    Source of queries of a request
+
+    ::view       - view name, with viewset action if there is one
+    ::explaining - true while a query plan is being read
+    """
+
+    def __init__(self, view):
+        self.view = view
+        self.explaining = False
+
+
+def view_name(request):
+    """
+    Returns name of the view which handles request, e.g. 'home'
+    or 'entry-detail:partial_update' for viewset actions
+    """
+    try:
+        match = resolve(request.path_info)
+    except Resolver404:
+        return "-"
+    name = match.view_name
+    actions = getattr(match.func, "actions", None)
+    if actions and request.method.lower() in actions:
+        name += ":" + actions[request.method.lower()]
+    # Names go into SQL, so only safe characters are kept
+    return re.sub(r"[^\w.:-]", "_", name)
+
+
+def call_site(depth):
+    """
+    Returns last depth frames of bloggy code which led to a query
+    """
+    frames = [
+        frame
+        for frame in traceback.extract_stack()
+        if frame.filename.startswith(settings.BASE_DIR)
+        and "site-packages" not in frame.filename
+        and frame.filename not in IGNORED_FILES
+    ]
+    return [
+        f"{os.path.relpath(frame.filename, settings.BASE_DIR)}:{frame.lineno}"
+        f" in {frame.name}"
+        for frame in frames[-depth:]
+    ]
+
+
+def explain(connection, sql, params):
+    with connection.cursor() as cursor:
+        cursor.execute(connection.ops.explain_query_prefix() + " " + sql, params)
+        return [" ".join(str(column) for column in row) for row in cursor.fetchall()]
+
+
+def query_wrapper(execute, sql, params, many, context):
+    """
+    Database execute wrapper tagging queries with their view and
+    logging slow ones
+    """
+    current = origin.get()
+    if current is None or current.explaining:
+        return execute(sql, params, many, context)
+    if settings.SQL_ORIGIN_COMMENTS:
+        sql = f"/* view={current.view} */ {sql}"
+    start = time.perf_counter()
+    result = execute(sql, params, many, context)
+    duration = (time.perf_counter() - start) * 1000
+    threshold = settings.SLOW_QUERY_LOG_MS
+    if threshold is None or duration < threshold:
+        return result
+    record = {
+        "duration_ms": round(duration, 1),
+        "view": current.view,
+        "sql": sql,
+        "stack": call_site(settings.SLOW_QUERY_STACK_DEPTH),
+    }
+    select = re.match(r"(/\*.*?\*/\s*)?SELECT\b", sql, re.IGNORECASE)
+    if settings.SLOW_QUERY_EXPLAIN and select and not many:
+        current.explaining = True
+        try:
+            record["explain"] = explain(context["connection"], sql, params)
+        finally:
+            current.explaining = False
+    logger.warning(json.dumps(record))
+    return result
@@ -0,0 +1,244 @@
+"""
+Full-text search over entries.
+
+Entries are indexed in a separate 'app_entry_search' table which is an FTS5
+virtual table on SQLite and a table with a tsvector column on PostgreSQL.
+The index is kept in sync by Entry.save and Entry.delete and can be rebuilt
+with 'python manage.py rebuild_search_index'.
+
+Results are ordered by relevance (lower score is better) and paginated
+with a cursor made of score and id of the last returned entry.
+"""
+import base64
+import binascii
+import re
+
+from django.db import DEFAULT_DB_ALIAS, connections
+
+SEARCH_TABLE = "app_entry_search"
+POSTGRESQL_SEARCH_CONFIG = "english"
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(score, pk):
+    return base64.urlsafe_b64encode(f"{score!r}:{pk}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Returns (score, id) tuple encoded in cursor
+    """
+    try:
+        score, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return float(score), int(pk)
+    except (binascii.Error, UnicodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+
+
+class SearchBackend:
+    """
+    Fallback backend for databases without full-text search support.
+    Doesn't keep an index and doesn't rank results (score is always 0).
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def create_index(self):
+        pass
+
+    def drop_index(self):
+        pass
+
+    def index_entry(self, entry):
+        pass
+
+    def remove_entry(self, pk):
+        self.remove_entries([pk])
+
+    def remove_entries(self, pks):
+        pass
+
+    def rebuild(self):
+        pass
+
+    def _filters(self, username, tag_name):
+        sql, params = "", []
+        if username is not None:
+            sql += (
+                " AND e.user_id IN (SELECT u.id FROM app_user u WHERE u.username = %s)"
+            )
+            params.append(username)
+        if tag_name is not None:
+            sql += (
+                " AND EXISTS (SELECT 1 FROM app_entry_tags t"
+                " WHERE t.entry_id = e.id AND t.tag_id = %s)"
+            )
+            params.append(tag_name)
+        return sql, params
+
+    def _fetch(self, sql, params, cursor, limit):
+        if cursor is not None:
+            sql = f"SELECT id, score FROM ({sql}) r WHERE (score > %s OR (score = %s AND id > %s))"
+            params += [cursor[0], cursor[0], cursor[1]]
+        else:
+            sql = f"SELECT id, score FROM ({sql}) r"
+        sql += " ORDER BY score, id LIMIT %s"
+        params.append(limit)
+        with self.connection.cursor() as c:
+            c.execute(sql, params)
+            return c.fetchall()
+
+    def search(self, query, username=None, tag_name=None, cursor=None, limit=15):
+        """
+        Returns list of (id, score) tuples of entries matching the query
+        """
+        filters, params = self._filters(username, tag_name)
+        sql = (
+            "SELECT e.id AS id, 0 AS score FROM app_entry e"
+            " WHERE e.deleted = %s AND e.content LIKE %s ESCAPE '\\'" + filters
+        )
+        pattern = "%" + re.sub(r"([%_\\])", r"\\\1", query) + "%"
+        return self._fetch(sql, [False, pattern] + params, cursor, limit)
+
+
+class SQLiteSearchBackend(SearchBackend):
+    def create_index(self):
+        with self.connection.cursor() as c:
+            c.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} "
+                "USING fts5(content, tokenize='unicode61')"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as c:
+            c.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index_entry(self, entry):
+        self.remove_entry(entry.pk)
+        if not entry.deleted:
+            with self.connection.cursor() as c:
+                c.execute(
+                    f"INSERT INTO {SEARCH_TABLE} (rowid, content) VALUES (%s, %s)",
+                    [entry.pk, entry.content],
+                )
+
+    def remove_entries(self, pks):
+        with self.connection.cursor() as c:
+            c.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN "
+                f"({', '.join(['%s'] * len(pks))})",
+                pks,
+            )
+
+    def rebuild(self):
+        with self.connection.cursor() as c:
+            c.execute(f"DELETE FROM {SEARCH_TABLE}")
+            c.execute(
+                f"INSERT INTO {SEARCH_TABLE} (rowid, content) "
+                "SELECT id, content FROM app_entry WHERE deleted = %s",
+                [False],
+            )
+            c.execute(
+                f"INSERT INTO {SEARCH_TABLE} ({SEARCH_TABLE}) VALUES ('optimize')"
+            )
+
+    def search(self, query, username=None, tag_name=None, cursor=None, limit=15):
+        # Quote every word so user input is never parsed as FTS5 query syntax
+        match = " ".join(
+            '"{}"'.format(word.replace('"', '""')) for word in query.split()
+        )
+        filters, params = self._filters(username, tag_name)
+        sql = (
+            f"SELECT s.rowid AS id, s.rank AS score FROM {SEARCH_TABLE} s"
+            " JOIN app_entry e ON e.id = s.rowid"
+            f" WHERE {SEARCH_TABLE} MATCH %s" + filters
+        )
+        return self._fetch(sql, [match] + params, cursor, limit)
+
+
+class PostgreSQLSearchBackend(SearchBackend):
+    def create_index(self):
+        with self.connection.cursor() as c:
+            c.execute(
+                f"CREATE TABLE IF NOT EXISTS {SEARCH_TABLE} ("
+                " entry_id integer PRIMARY KEY REFERENCES app_entry (id)"
+                " ON DELETE CASCADE DEFERRABLE INITIALLY DEFERRED,"
+                " document tsvector NOT NULL)"
+            )
+            c.execute(
+                f"CREATE INDEX IF NOT EXISTS {SEARCH_TABLE}_document_idx "
+                f"ON {SEARCH_TABLE} USING gin (document)"
+            )
+
+    def drop_index(self):
+        with self.connection.cursor() as c:
+            c.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+    def index_entry(self, entry):
+        if entry.deleted:
+            return self.remove_entry(entry.pk)
+        with self.connection.cursor() as c:
+            c.execute(
+                f"INSERT INTO {SEARCH_TABLE} (entry_id, document) "
+                "VALUES (%s, to_tsvector(%s::regconfig, %s)) ON CONFLICT (entry_id) "
+                "DO UPDATE SET document = EXCLUDED.document",
+                [entry.pk, POSTGRESQL_SEARCH_CONFIG, entry.content],
+            )
+
+    def remove_entries(self, pks):
+        with self.connection.cursor() as c:
+            c.execute(f"DELETE FROM {SEARCH_TABLE} WHERE entry_id = ANY(%s)", [pks])
+
+    def rebuild(self):
+        with self.connection.cursor() as c:
+            c.execute(f"TRUNCATE {SEARCH_TABLE}")
+            c.execute(
+                f"INSERT INTO {SEARCH_TABLE} (entry_id, document) "
+                "SELECT id, to_tsvector(%s::regconfig, content) FROM app_entry"
+                " WHERE NOT deleted",
+                [POSTGRESQL_SEARCH_CONFIG],
+            )
+
+    def search(self, query, username=None, tag_name=None, cursor=None, limit=15):
+        filters, params = self._filters(username, tag_name)
+        # ts_rank_cd is higher for better matches, negate it to order ascending
+        sql = (
+            "SELECT s.entry_id AS id, -ts_rank_cd(s.document, q) AS score"
+            f" FROM {SEARCH_TABLE} s JOIN app_entry e ON e.id = s.entry_id,"
+            " plainto_tsquery(%s::regconfig, %s) q WHERE s.document @@ q" + filters
+        )
+        return self._fetch(
+            sql, [POSTGRESQL_SEARCH_CONFIG, query] + params, cursor, limit
+        )
+
+
+BACKENDS = {"sqlite": SQLiteSearchBackend, "postgresql": PostgreSQLSearchBackend}
+
+
+def get_backend(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+    return BACKENDS.get(connection.vendor, SearchBackend)(connection)
+
+
+def search_entries(query, username=None, tag_name=None, cursor=None, limit=15):
+    """
+    Returns ids of entries matching the query (best matches first)
+    and a cursor to the next page (None if it's the last page).
+    Results can be narrowed to entries of a user and entries with a tag.
+    """
+    if not query.split():
+        return [], None
+    if cursor is not None:
+        cursor = decode_cursor(cursor)
+    username = username.lower() if username else None
+    tag_name = tag_name.lower() if tag_name else None
+    rows = get_backend().search(query, username, tag_name, cursor, limit + 1)
+    next_cursor = None
+    if len(rows) > limit:
+        pk, score = rows[limit - 1]
+        next_cursor = encode_cursor(score, pk)
+    return [pk for pk, _ in rows[:limit]], next_cursor
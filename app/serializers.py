@@ -1,33 +1,26 @@
 from rest_framework import serializers
 
 from .models import Entry, Notification, PrivateMessage, Tag, User
+from .timing import TimedSerializerMixin
 
 
-class TagSerializer(serializers.ModelSerializer):
-    observers = serializers.SerializerMethodField()
-    user_observes = serializers.SerializerMethodField()
-    user_blacklisted = serializers.SerializerMethodField()
+class TagSerializer(TimedSerializerMixin, serializers.ModelSerializer):
+    # Annotated by Tag.objects.with_api_data
+    observers = serializers.IntegerField(source="observers_count", read_only=True)
+    user_observes = serializers.BooleanField(read_only=True)
+    user_blacklisted = serializers.BooleanField(read_only=True)
 
     class Meta:
         model = Tag
         read_only_fields = ("author", "name")
         fields = ("name", "author", "observers", "user_observes", "user_blacklisted")
 
-    def get_observers(self, obj):
-        return obj.observers.all().count()
 
-    def get_user_observes(self, obj):
-        u = self.context.get("request").user
-        return obj.observers.filter(pk=u.pk).exists()
-
-    def get_user_blacklisted(self, obj):
-        u = self.context.get("request").user
-        return obj.blacklisters.filter(pk=u.pk).exists()
-
-
-class NotificationSerializer(serializers.HyperlinkedModelSerializer):
+class NotificationSerializer(
+    TimedSerializerMixin, serializers.HyperlinkedModelSerializer
+):
     sender = serializers.ReadOnlyField(source="sender.username")
-    object = serializers.ReadOnlyField(source="object_id")
+    object = serializers.SerializerMethodField()
     target = serializers.ReadOnlyField(source="target.username")
 
     class Meta:
@@ -41,6 +34,7 @@ class Meta:
             "target",
             "created_date",
             "content",
+            "actors_count",
         )
         fields = (
             "id",
@@ -51,15 +45,22 @@ class Meta:
             "target",
             "created_date",
             "read",
+            "actors_count",
         )
 
+    def get_object(self, obj):
+        # Entries are referenced by ids, tags (letters only) by names
+        if obj.object_id.isdigit():
+            return int(obj.object_id)
+        return obj.object_id
+
     def validate_read(self, value):
         if value is not True:
             raise serializers.ValidationError("Cannot unread notifications")
         return value
 
 
-class PrivateMessageSerializer(serializers.ModelSerializer):
+class PrivateMessageSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     author = serializers.ReadOnlyField(source="author.username")
     target = serializers.CharField()
     read = serializers.SerializerMethodField()
@@ -91,7 +92,7 @@ class Meta:
         read_only_fields = ("id", "author", "created_date", "read_date", "read")
 
 
-class EntrySerializer(serializers.HyperlinkedModelSerializer):
+class EntrySerializer(TimedSerializerMixin, serializers.HyperlinkedModelSerializer):
     user = serializers.ReadOnlyField(source="user.username")
     upvotes = serializers.SerializerMethodField()
     downvotes = serializers.SerializerMethodField()
@@ -136,16 +137,27 @@ def validate_parent(self, value):
                 )
         return value
 
+    # Counts and user's votes are annotated by Entry.objects.with_api_data,
+    # entries which aren't annotated are looked up one by one
+
     def get_upvotes(self, obj):
+        if hasattr(obj, "upvotes_count"):
+            return obj.upvotes_count
         return obj.upvotes.count()
 
     def get_downvotes(self, obj):
+        if hasattr(obj, "downvotes_count"):
+            return obj.downvotes_count
         return obj.downvotes.count()
 
     def get_user_upvoted(self, obj):
+        if hasattr(obj, "user_upvoted"):
+            return obj.user_upvoted
         u = self.context.get("request").user
         return obj.upvotes.filter(pk=u.pk).exists()
 
     def get_user_downvoted(self, obj):
+        if hasattr(obj, "user_downvoted"):
+            return obj.user_downvoted
         u = self.context.get("request").user
         return obj.downvotes.filter(pk=u.pk).exists()
@@ -1,10 +1,17 @@
 import re
 
-from django.db.models.signals import m2m_changed, post_save, pre_delete
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from django.urls import reverse
 
-from .models import Entry, Notification, User
+from . import metrics
+from .database import check_connections
+from .models import Entry, Notification, Tag, User
+from .notifications import fan_out_tag_notifications
+from .pagecache import invalidate_pages
+from .sqlite import apply_pragmas
+from .timeline import fan_out_entry
 
 
 @receiver(post_save, sender=Entry)
@@ -13,6 +20,7 @@ def entry_notification(sender, instance, created, **kwargs):
     Signal used to create notification(s) when an entry is created
     This function notifies an user if this entry is a reply to him.
     This function notifies an user if he's mentioned (by @username) in one's entry
+    Replies to the same entry are coalesced into a single notification.
     """
     if created:
         # First find usernames mentioned (by @ tag)
@@ -32,67 +40,103 @@ def entry_notification(sender, instance, created, **kwargs):
         if instance.parent and instance.parent.user.username != instance.user.username:
             if instance.parent.user.username in usernames:
                 usernames.remove(instance.parent.user.username)
-            Notification.objects.create(
+            Notification.objects.notify(
                 type="user_replied",
                 sender=instance.user,
-                target=instance.parent.user,
-                object=instance,
+                object=instance.parent,
+                targets=[instance.parent.user_id],
+                entry=instance,
             )
         # Notify mentioned users without the author of an entry
-        for name in usernames:
-            if name == instance.user.username:
-                continue
-            try:
-                target = User.objects.get(username=name)
-            except Exception:
-                continue
-            Notification.objects.create(
+        if usernames:
+            Notification.objects.notify(
                 type="user_mentioned",
                 sender=instance.user,
-                target=target,
                 object=instance,
+                targets=User.objects.filter(username__in=usernames).values_list(
+                    "pk", flat=True
+                ),
+                entry=instance,
             )
 
 
 @receiver(m2m_changed, sender=Entry.tags.through)
-def entry_tag_notification(instance, action, **kwargs):
+def entry_tag_notification(instance, action, reverse, pk_set, **kwargs):
     """
     Notifies users if one of the tags in entry is observed by them.
+    Unread notifications about the same tag are coalesced.
     """
-    if not instance.modified_date and "post" in action:
-        already_notified = set()
-        reversed_user = reverse(
-            "user-detail-view", kwargs={"username": instance.user.username}
-        )
-        reversed_entry = reverse("entry-detail-view", kwargs={"pk": instance.pk})
-        all_tags = instance.tags.all().prefetch_related("observers", "blacklisters")
-        all_blacklisters = [
-            blacklister for tag in all_tags for blacklister in tag.blacklisters.all()
-        ]
-        to_create = []
-        for tag in all_tags:
-            for observer in tag.observers.all():
-                # If user blacklisted one of the tags in an entry, don't notify him.
-                if observer in all_blacklisters:
-                    continue
-                if (
-                    observer.username == instance.user.username
-                    or observer in already_notified
-                ):
-                    continue
-                reversed_tag = reverse("tag", kwargs={"tag": tag.name})
-                content = (
-                    f'<a href="{reversed_user}">{instance.user.username}</a> used tag <a href="{reversed_tag}">#{tag.name}</a>'
-                    f' in <a href="{reversed_entry}">"{instance.content:.25}..."</a>'
-                )
-                to_create.append(
-                    Notification(
-                        type="tag_used",
-                        sender=instance.user,
-                        target=observer,
-                        object=instance,
-                        content=content,
-                    )
-                )
-                already_notified.add(observer)
-        Notification.objects.bulk_create(to_create)
+    if action == "post_add" and not reverse and not instance.modified_date:
+        notified = fan_out_tag_notifications(instance, pk_set)
+        metrics.observe("bloggy_notification_fanout_size", notified)
+
+
+@receiver(m2m_changed, sender=Entry.tags.through)
+def entry_timeline_fan_out(instance, action, reverse, pk_set, **kwargs):
+    """
+    Adds a new root entry to timelines of users observing its tags.
+    """
+    if (
+        action == "post_add"
+        and not reverse
+        and not instance.modified_date
+        and instance.is_root_node()
+    ):
+        fan_out_entry(instance, pk_set)
+
+
+@receiver(post_save, sender=Entry)
+@receiver(post_delete, sender=Entry)
+def entry_invalidate_pages(**kwargs):
+    """
+    Makes cached pages stale when an entry is created, edited or deleted.
+    """
+    invalidate_pages()
+
+
+@receiver(m2m_changed, sender=Entry.upvotes.through)
+@receiver(m2m_changed, sender=Entry.downvotes.through)
+@receiver(m2m_changed, sender=Entry.tags.through)
+@receiver(m2m_changed, sender=Tag.observers.through)
+def relation_invalidate_pages(action, **kwargs):
+    """
+    Makes cached pages stale when votes, tags of entries or observers of tags change.
+    """
+    if action.startswith("post_"):
+        invalidate_pages()
+
+
+@receiver(post_save, sender=Entry)
+def entry_count_created(created, **kwargs):
+    """
+    Counts created entries in metrics.
+    """
+    if created:
+        metrics.inc("bloggy_entries_created_total")
+
+
+@receiver(m2m_changed, sender=Entry.upvotes.through)
+@receiver(m2m_changed, sender=Entry.downvotes.through)
+def vote_count_cast(sender, action, pk_set, **kwargs):
+    """
+    Counts cast votes in metrics.
+    """
+    if action == "post_add" and pk_set:
+        direction = "up" if sender is Entry.upvotes.through else "down"
+        metrics.inc("bloggy_votes_total", len(pk_set), direction=direction)
+
+
+@receiver(connection_created)
+def connection_apply_pragmas(connection, **kwargs):
+    """
+    Tunes every new SQLite connection with SQLITE_PRAGMAS.
+    """
+    apply_pragmas(connection)
+
+
+@receiver(request_started)
+def request_check_connections(**kwargs):
+    """
+    Reopens persistent connections dropped by the database server.
+    """
+    check_connections()
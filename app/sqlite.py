@@ -0,0 +1,52 @@
+"""
+SQLite tuning.
+
+SQLITE_PRAGMAS are applied to every new SQLite connection. The defaults
+(WAL journal, busy timeout, NORMAL synchronous, memory mapped I/O, bigger
+page cache and temp tables in memory) let readers work while a writer
+commits and make concurrent writers wait instead of failing with
+"database is locked". 'python manage.py sqlite_maintenance' checkpoints
+the WAL file and runs PRAGMA optimize, it should be run periodically.
+"""
+import re
+
+from django.conf import settings
+
+ALLOWED_PRAGMAS = {
+    "journal_mode",
+    "busy_timeout",
+    "synchronous",
+    "mmap_size",
+    "cache_size",
+    "temp_store",
+}
+PRAGMA_VALUE_RE = re.compile(r"^-?\w+$")
+
+
+def apply_pragmas(connection):
+    """
+    Applies SQLITE_PRAGMAS to a connection (other databases are skipped).
+    Pragmas with empty values are left at SQLite defaults.
+    """
+    if connection.vendor != "sqlite":
+        return
+    with connection.cursor() as c:
+        for name, value in settings.SQLITE_PRAGMAS.items():
+            if value in (None, ""):
+                continue
+            # Pragmas can't be parametrized, so only plain values are allowed
+            if name not in ALLOWED_PRAGMAS or not PRAGMA_VALUE_RE.match(str(value)):
+                raise ValueError(f"Invalid SQLite pragma: {name} = {value}")
+            c.execute(f"PRAGMA {name} = {value}")
+
+
+def checkpoint(connection, mode="TRUNCATE"):
+    """
+    Checkpoints the WAL file and optimizes the database.
+    Returns (busy, wal frames, checkpointed frames) reported by SQLite.
+    """
+    with connection.cursor() as c:
+        c.execute(f"PRAGMA wal_checkpoint({mode})")
+        result = c.fetchone()
+        c.execute("PRAGMA optimize")
+    return result
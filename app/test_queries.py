@@ -0,0 +1,293 @@
+"""
+Query count budgets of views and API endpoints.
+
+Every URL of app/urls.py and every route of bloggy/api.py is requested by
+an anonymous and an authenticated user on a dataset bigger than a page and
+the number of queries is checked against a fixed budget. GET requests are
+repeated after the dataset has grown, so a budget which depends on the number
+of entries (or users, tags, messages) on a page fails the tests.
+"""
+import string
+
+from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from .models import Entry, Notification, PrivateMessage, Tag, User
+
+# Budgets of (anonymous, authenticated) users. Anonymous users are
+# redirected to login (or get 403 from the API) before any query is made.
+HTML_BUDGETS = {
+    "home": (5, 13),
+    "top": (5, 13),
+    "hot": (5, 13),
+    "tag": (7, 14),
+    "ranking": (2, 9),
+    "search": (2, 9),
+    "timeline": (0, 12),
+    "entry-detail-view": (3, 10),
+    "notifications-all": (0, 11),
+    "inbox": (0, 9),
+    "inbox-user-view": (0, 10),
+    "user-detail-view": (4, 11),
+    "user-discussions-view": (5, 12),
+    "account_signup": (0, 2),
+    "metrics": (0, 2),
+    "export": (0, 2),
+}
+API_BUDGETS = {
+    "entries-list": (0, 5),
+    "entries-create": (0, 22),
+    "entries-detail": (0, 5),
+    "entries-update": (0, 16),
+    "entries-delete": (0, 24),
+    "entries-upvote": (0, 10),
+    "entries-downvote": (0, 10),
+    "entries-bulk-delete": (0, 23),
+    "entries-search": (0, 5),
+    "entries-timeline": (0, 6),
+    "notifications-list": (0, 4),
+    "notifications-detail": (0, 3),
+    "notifications-read": (0, 4),
+    "notifications-read-all": (0, 5),
+    "notifications-unread": (0, 4),
+    "privatemessages-list": (0, 4),
+    "privatemessages-create": (0, 4),
+    "privatemessages-detail": (0, 3),
+    "privatemessages-read": (0, 4),
+    "privatemessages-read-all": (0, 3),
+    "privatemessages-unread": (0, 3),
+    "tags-list": (0, 4),
+    "tags-detail": (0, 3),
+    "tags-blacklist": (0, 10),
+    "tags-observe": (0, 9),
+    "trending-tags-list": (0, 3),
+}
+
+
+def tag_name(number):
+    # Tag names are made of letters only
+    letters = string.ascii_lowercase
+    return "tag" + letters[number // 26 % 26] + letters[number % 26]
+
+
+class QueryBudgetTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(
+            "budget", "budget@budget.com", "budget", display_name="budget"
+        )
+        self.admin = User.objects.create_superuser(
+            "admin", "admin@budget.com", "admin", display_name="admin"
+        )
+        self.seeded = 0
+        self.seed(20)
+        self.entry = Entry.objects.filter(parent=None).exclude(user=self.user).first()
+        self.own_entry = Entry.objects.filter(user=self.user).first()
+        self.other = User.objects.exclude(pk__in=[self.user.pk, self.admin.pk]).first()
+        self.tag = Tag.objects.order_by("name").first()
+        self.notification = Notification.objects.filter(target=self.user).first()
+        self.private_message = PrivateMessage.objects.filter(target=self.user).first()
+
+    def seed(self, count):
+        """
+        Adds count users, tags observed by the user, discussions (with replies,
+        mentions, votes and notifications) and private messages
+        """
+        start, self.seeded = self.seeded, self.seeded + count
+        users = [
+            User.objects.create_user(
+                f"user{number}",
+                f"user{number}@budget.com",
+                "user",
+                display_name=f"user{number}",
+            )
+            for number in range(start, self.seeded)
+        ]
+        for number, author in zip(range(start, self.seeded), users):
+            Tag.objects.create(name=tag_name(number)).observers.add(self.user)
+            root = Entry.objects.create(
+                user=author,
+                content=f"root #{tag_name(number)} @{self.user.username} zebra",
+            )
+            root.upvotes.add(*users[:3])
+            root.downvotes.add(self.user)
+            reply = Entry.objects.create(
+                user=self.user, content="reply zebra", parent=root
+            )
+            Entry.objects.create(user=author, content="reply zebra", parent=reply)
+            Entry.objects.create(user=self.user, content=f"own #{tag_name(number)}")
+            for sender, target in [(author, self.user), (self.user, author)]:
+                PrivateMessage.objects.create(author=sender, target=target, text="pm")
+                PrivateMessage.objects.create(
+                    author=sender,
+                    target=target if target != author else users[0],
+                    text="pm",
+                )
+
+    def html_routes(self):
+        """
+        Returns (name, url) of every URL in app/urls.py
+        """
+        return [
+            ("home", reverse("home")),
+            ("top", reverse("top")),
+            ("hot", reverse("hot")),
+            ("tag", reverse("tag", args=[self.tag.name])),
+            ("ranking", reverse("ranking")),
+            ("search", reverse("search") + "?q=zebra"),
+            ("timeline", reverse("timeline")),
+            ("entry-detail-view", reverse("entry-detail-view", args=[self.entry.pk])),
+            ("notifications-all", reverse("notifications-all")),
+            ("inbox", reverse("inbox")),
+            (
+                "inbox-user-view",
+                reverse("inbox-user-view", args=[self.other.username]),
+            ),
+            (
+                "user-detail-view",
+                reverse("user-detail-view", args=[self.user.username]),
+            ),
+            (
+                "user-discussions-view",
+                reverse("user-discussions-view", args=[self.user.username]),
+            ),
+            ("account_signup", reverse("account_signup")),
+            ("metrics", reverse("metrics")),
+            ("export", reverse("export")),
+        ]
+
+    def api_routes(self):
+        """
+        Returns (name, method, url, data) of every route in bloggy/api.py.
+        Requests which change data are ordered so they don't affect each other.
+        """
+        entry, own = self.entry.pk, self.own_entry.pk
+        notification, message = self.notification.pk, self.private_message.pk
+        return [
+            ("entries-list", "get", reverse("entry-list"), None),
+            ("entries-detail", "get", reverse("entry-detail", args=[entry]), None),
+            ("entries-search", "get", reverse("entry-search") + "?q=zebra", None),
+            ("entries-timeline", "get", reverse("entry-timeline"), None),
+            ("notifications-list", "get", reverse("notifications-list"), None),
+            (
+                "notifications-detail",
+                "get",
+                reverse("notifications-detail", args=[notification]),
+                None,
+            ),
+            ("notifications-unread", "get", reverse("notifications-unread"), None),
+            ("privatemessages-list", "get", reverse("privatemessages-list"), None),
+            (
+                "privatemessages-detail",
+                "get",
+                reverse("privatemessages-detail", args=[message]),
+                None,
+            ),
+            ("privatemessages-unread", "get", reverse("privatemessages-unread"), None),
+            ("tags-list", "get", reverse("tags-list"), None),
+            ("tags-detail", "get", reverse("tags-detail", args=[self.tag.pk]), None),
+            ("trending-tags-list", "get", reverse("trending-tags-list"), None,),
+            (
+                "entries-create",
+                "post",
+                reverse("entry-list"),
+                {"content": "new #python"},
+            ),
+            (
+                "entries-update",
+                "patch",
+                reverse("entry-detail", args=[own]),
+                {"content": "edited #python"},
+            ),
+            ("entries-upvote", "post", reverse("entry-upvote", args=[entry]), None),
+            ("entries-downvote", "post", reverse("entry-downvote", args=[entry]), None),
+            (
+                "notifications-read",
+                "post",
+                reverse("notifications-read", args=[notification]),
+                None,
+            ),
+            ("notifications-read-all", "post", reverse("notifications-read-all"), None),
+            (
+                "privatemessages-create",
+                "post",
+                reverse("privatemessages-list"),
+                {"text": "hello", "target": self.other.username},
+            ),
+            (
+                "privatemessages-read",
+                "post",
+                reverse("privatemessages-read", args=[message]),
+                None,
+            ),
+            (
+                "privatemessages-read-all",
+                "post",
+                reverse("privatemessages-read-all"),
+                None,
+            ),
+            (
+                "tags-blacklist",
+                "post",
+                reverse("tags-blacklist", args=[self.tag.pk]),
+                None,
+            ),
+            ("tags-observe", "post", reverse("tags-observe", args=[self.tag.pk]), None),
+            ("entries-delete", "delete", reverse("entry-detail", args=[own]), None),
+            (
+                "entries-bulk-delete",
+                "post",
+                reverse("entry-bulk-delete"),
+                {"ids": [entry]},
+            ),
+        ]
+
+    def count_queries(self, method, url, data=None):
+        # Cold cache is the worst case
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data, format="json")
+        self.assertLess(response.status_code, 500, url)
+        return len(queries)
+
+    def check_budgets(self, routes, budgets, authenticated):
+        """
+        Checks budgets of routes. GET requests are checked again
+        on a bigger dataset before any data is changed.
+        """
+        reads = [route for route in routes if route[1] == "get"]
+        writes = [route for route in routes if route[1] != "get"]
+        counts = {
+            name: self.count_queries(method, url, data)
+            for name, method, url, data in reads
+        }
+        self.seed(20)
+        for name, method, url, data in reads:
+            with self.subTest(route=name):
+                self.assertEqual(self.count_queries(method, url, data), counts[name])
+        for name, method, url, data in writes:
+            if name == "entries-bulk-delete" and authenticated:
+                self.client.force_login(self.admin)
+            counts[name] = self.count_queries(method, url, data)
+        for name, count in counts.items():
+            with self.subTest(route=name):
+                self.assertLessEqual(count, budgets[name][authenticated])
+
+    def test_html_anonymous(self):
+        routes = [(name, "get", url, None) for name, url in self.html_routes()]
+        self.check_budgets(routes, HTML_BUDGETS, False)
+
+    def test_html_authenticated(self):
+        self.client.force_login(self.user)
+        routes = [(name, "get", url, None) for name, url in self.html_routes()]
+        self.check_budgets(routes, HTML_BUDGETS, True)
+
+    def test_api_anonymous(self):
+        self.check_budgets(self.api_routes(), API_BUDGETS, False)
+
+    def test_api_authenticated(self):
+        self.client.force_login(self.user)
+        self.check_budgets(self.api_routes(), API_BUDGETS, True)
@@ -0,0 +1,155 @@
+"""
+Timelines of observed tags.
+
+A root entry with tags is written to timelines (see TimelineEntry) of users
+observing its tags when it's created (fan-out on write). Tags with more than
+TIMELINE_FANOUT_LIMIT observers are skipped on write and their entries are
+read from the tag feed index instead (fan-out on read), so a single entry
+never writes an unbounded number of rows.
+
+Timelines are read newest first with keyset pagination on (created_date, id)
+and trimmed to TIMELINE_MAX_ENTRIES by 'python manage.py trim_timelines'.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, Exists, Max, OuterRef, Q
+
+from . import metrics
+from .database import rows_at_position
+from .models import Entry, EntryTag, Tag, TimelineEntry
+
+POPULAR_TAGS_CACHE_KEY = "timeline_popular_tags"
+
+
+def get_popular_tags():
+    """
+    Returns cached set of names of tags observed by more than
+    TIMELINE_FANOUT_LIMIT users. Entries with these tags aren't fanned out.
+    """
+    popular = metrics.cache_lookup("popular_tags", cache.get(POPULAR_TAGS_CACHE_KEY))
+    if popular is None:
+        popular = set(
+            Tag.observers.through.objects.values("tag")
+            .annotate(observers_count=Count("id"))
+            .filter(observers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+            .values_list("tag", flat=True)
+        )
+        cache.set(POPULAR_TAGS_CACHE_KEY, popular, settings.TAG_CACHE_TIMEOUT)
+    return popular
+
+
+def fan_out_entry(entry, tag_names):
+    """
+    Adds a root entry to timelines of observers of its tags with a single
+    INSERT ... SELECT. The author and users who blacklisted one of the tags
+    are skipped.
+    """
+    tag_names = list(tag_names)
+    popular = get_popular_tags()
+    fanned = [name for name in tag_names if name not in popular]
+    if not fanned:
+        return
+    observers = Tag.observers.through._meta.db_table
+    blacklisters = Tag.blacklisters.through._meta.db_table
+    sql = (
+        f"INSERT INTO {TimelineEntry._meta.db_table} (user_id, entry_id, created_date)"
+        f" SELECT DISTINCT o.user_id, %s, %s FROM {observers} o"
+        f" WHERE o.tag_id IN ({', '.join(['%s'] * len(fanned))}) AND o.user_id <> %s"
+        f" AND NOT EXISTS (SELECT 1 FROM {blacklisters} b WHERE b.user_id = o.user_id"
+        f" AND b.tag_id IN ({', '.join(['%s'] * len(tag_names))}))"
+    )
+    created_date = connection.ops.adapt_datetimefield_value(entry.created_date)
+    with connection.cursor() as c:
+        c.execute(sql, [entry.pk, created_date] + fanned + [entry.user_id] + tag_names)
+
+
+def _before(queryset, before):
+    created_date, pk = before
+    return queryset.filter(
+        Q(created_date__lt=created_date) | Q(created_date=created_date, entry__lt=pk)
+    )
+
+
+def get_timeline(user, before=None, limit=15):
+    """
+    Returns ids of root entries with tags observed by user (newest first)
+    and id of the last returned entry if there is a next page (None otherwise).
+    'before' is the id of the last entry of the previous page.
+    """
+    queries = [TimelineEntry.objects.filter(user=user)]
+    popular = get_popular_tags()
+    if popular:
+        observed = list(
+            Tag.objects.filter(observers=user, name__in=popular).values_list(
+                "name", flat=True
+            )
+        )
+        if observed:
+            feed = EntryTag.objects.filter(tag__in=observed, is_root=True).exclude(
+                entry__user=user
+            )
+            blacklist = Tag.objects.blacklisted_by(user)
+            if blacklist:
+                feed = feed.annotate(
+                    blacklisted=Exists(
+                        EntryTag.objects.filter(
+                            entry=OuterRef("entry"), tag__in=blacklist
+                        )
+                    )
+                ).filter(blacklisted=False)
+            queries.append(feed)
+    if before is not None:
+        created_date = (
+            Entry.objects.filter(pk=before)
+            .values_list("created_date", flat=True)
+            .first()
+        )
+        if created_date is None:
+            return [], None
+        queries = [_before(query, (created_date, before)) for query in queries]
+    rows = {}
+    for query in queries:
+        # Feed has a row per tag, so rows are grouped by entry before slicing
+        rows.update(
+            query.values("entry")
+            .annotate(created=Max("created_date"))
+            .order_by("-created", "-entry")
+            .values_list("entry", "created")[: limit + 1]
+        )
+    ids = sorted(rows, key=lambda pk: (rows[pk], pk), reverse=True)
+    next_before = ids[limit - 1] if len(ids) > limit else None
+    return ids[:limit], next_before
+
+
+def trim_timelines():
+    """
+    Deletes the oldest rows of timelines longer than TIMELINE_MAX_ENTRIES.
+    Returns number of deleted rows.
+    """
+    max_entries = settings.TIMELINE_MAX_ENTRIES
+    deleted = 0
+    if connection.features.supports_over_clause:
+        # The last kept row of every timeline is found with a single query
+        last_rows = rows_at_position(
+            TimelineEntry, "user", ["-created_date", "-entry"], max_entries
+        ).values_list("user", "created_date", "entry")
+    else:
+        too_long = (
+            TimelineEntry.objects.values("user")
+            .annotate(entries_count=Count("id"))
+            .filter(entries_count__gt=max_entries)
+            .values_list("user", flat=True)
+        )
+        last_rows = (
+            (user_id,)
+            + TimelineEntry.objects.filter(user=user_id)
+            .order_by("-created_date", "-entry")
+            .values_list("created_date", "entry")[max_entries - 1]
+            for user_id in too_long
+        )
+    for user_id, created_date, entry_id in last_rows:
+        timeline = TimelineEntry.objects.filter(user=user_id)
+        count, _ = _before(timeline, (created_date, entry_id)).delete()
+        deleted += count
+    return deleted
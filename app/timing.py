@@ -0,0 +1,93 @@
+"""
+Timing of requests.
+
+TimingMiddleware (see app.middleware) starts a RequestTimer for a sample of
+requests (REQUEST_TIMING_SAMPLE_RATE). While it runs, SQL queries of every
+connection, template rendering (TimedDjangoTemplates backend) and API
+serialization (TimedSerializerMixin) add their durations to it. Nested
+measurements of the same kind (included templates, nested serializers) are
+counted once. Outside of sampled requests measure() does nothing.
+"""
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.template.backends.django import DjangoTemplates, Template
+
+timer = ContextVar("timer", default=None)
+
+
+class RequestTimer:
+    """
+    Durations of a request
+
+    ::start     - perf_counter() at the start of the request
+    ::durations - seconds spent in every kind of work (db, template, serializer)
+    ::counts    - number of measurements of every kind
+    ::active    - kinds of work being measured right now
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.active = set()
+
+    def total(self):
+        return time.perf_counter() - self.start
+
+
+@contextmanager
+def measure(name):
+    """
+    Adds duration of the block to timer of the current request
+    """
+    current = timer.get()
+    if current is None or name in current.active:
+        yield
+        return
+    current.active.add(name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.durations[name] += time.perf_counter() - start
+        current.counts[name] += 1
+        current.active.discard(name)
+
+
+def record_query(execute, sql, params, many, context):
+    """
+    Database execute wrapper measuring queries
+    """
+    with measure("db"):
+        return execute(sql, params, many, context)
+
+
+class TimedTemplate(Template):
+    def render(self, context=None, request=None):
+        with measure("template"):
+            return super().render(context, request)
+
+
+class TimedDjangoTemplates(DjangoTemplates):
+    """
+    Django templates backend measuring rendering
+    """
+
+    def from_string(self, template_code):
+        return TimedTemplate(super().from_string(template_code).template, self)
+
+    def get_template(self, template_name):
+        return TimedTemplate(super().get_template(template_name).template, self)
+
+
+class TimedSerializerMixin:
+    """
+    Measures serialization of API objects
+    """
+
+    def to_representation(self, instance):
+        with measure("serializer"):
+            return super().to_representation(instance)
@@ -0,0 +1,120 @@
+"""
+Trending tags.
+
+Tag usage is counted in hourly buckets (see TagUsage) by Entry.save.
+A tag is trending when its usage rate in the last TRENDING_TAGS_RECENT_HOURS
+is high compared to its rate in the last TRENDING_TAGS_BASELINE_DAYS.
+
+Trending tags are computed from buckets and served from a cached snapshot
+which is refreshed after TRENDING_TAGS_REFRESH seconds or by
+'python manage.py refresh_trending_tags' which also compacts old hourly
+buckets into daily ones.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncDay
+from django.utils import timezone
+
+from . import metrics
+from .models import TagUsage
+
+TRENDING_TAGS_CACHE_KEY = "trending_tags"
+
+
+def compute_trending_tags(now=None):
+    """
+    Returns list of trending tags as dicts with 'name', 'score' and 'uses'
+    (how many times tag was used recently), best scored first.
+    """
+    now = now or timezone.now()
+    recent_since = now - timedelta(hours=settings.TRENDING_TAGS_RECENT_HOURS)
+    baseline_hours = settings.TRENDING_TAGS_BASELINE_DAYS * 24
+    usage = (
+        TagUsage.objects.filter(bucket__gte=now - timedelta(hours=baseline_hours))
+        .values("tag")
+        .annotate(
+            recent=Sum("count", filter=Q(bucket__gte=recent_since)), total=Sum("count")
+        )
+        .filter(recent__gte=settings.TRENDING_TAGS_MIN_USES)
+    )
+    trending = []
+    for tag in usage:
+        recent_rate = tag["recent"] / settings.TRENDING_TAGS_RECENT_HOURS
+        # Smooth the baseline so tags which weren't used before don't divide by 0
+        baseline_rate = (tag["total"] - tag["recent"] + 1) / baseline_hours
+        trending.append(
+            {
+                "name": tag["tag"],
+                "score": round(recent_rate / baseline_rate, 2),
+                "uses": tag["recent"],
+            }
+        )
+    trending.sort(key=lambda t: (-t["score"], t["name"]))
+    return trending[: settings.TRENDING_TAGS_COUNT]
+
+
+def refresh_trending_tags():
+    trending = compute_trending_tags()
+    cache.set(TRENDING_TAGS_CACHE_KEY, trending, settings.TRENDING_TAGS_REFRESH)
+    return trending
+
+
+def get_trending_tags():
+    """
+    Returns cached snapshot of trending tags (computes it if it's missing)
+    """
+    trending = metrics.cache_lookup("trending_tags", cache.get(TRENDING_TAGS_CACHE_KEY))
+    if trending is None:
+        trending = refresh_trending_tags()
+    return trending
+
+
+def compact_tag_usage(now=None):
+    """
+    Merges hourly buckets of days older than TAG_USAGE_COMPACT_AFTER_DAYS
+    into daily buckets. Returns number of compacted hourly buckets.
+    """
+    now = now or timezone.now()
+    until = (now - timedelta(days=settings.TAG_USAGE_COMPACT_AFTER_DAYS)).replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    hourly = TagUsage.objects.filter(period=TagUsage.HOUR, bucket__lt=until)
+    with transaction.atomic():
+        totals = (
+            hourly.annotate(day=TruncDay("bucket"))
+            .values("tag", "day")
+            .annotate(total=Sum("count"))
+        )
+        if not totals:
+            return 0
+        daily = {
+            (usage.tag_id, usage.bucket): usage
+            for usage in TagUsage.objects.filter(
+                period=TagUsage.DAY,
+                bucket__gte=min(total["day"] for total in totals),
+                bucket__lt=until,
+            )
+        }
+        to_create, to_update = [], []
+        for total in totals:
+            usage = daily.get((total["tag"], total["day"]))
+            if usage:
+                usage.count += total["total"]
+                to_update.append(usage)
+            else:
+                to_create.append(
+                    TagUsage(
+                        tag_id=total["tag"],
+                        period=TagUsage.DAY,
+                        bucket=total["day"],
+                        count=total["total"],
+                    )
+                )
+        TagUsage.objects.bulk_update(to_update, ["count"])
+        TagUsage.objects.bulk_create(to_create)
+        compacted, _ = hourly.delete()
+    return compacted
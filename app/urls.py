@@ -1,24 +1,33 @@
 from django.contrib.auth.decorators import user_passes_test
 from django.urls import path
 
+from .pagecache import cache_anonymous_page
 from .views import (
     EntryDetailView,
+    ExportView,
     HomeView,
+    MetricsView,
     NotificationListView,
     PrivateMessageView,
+    SearchView,
     SignUpView,
+    TimelineView,
     UserDetailView,
+    UserDiscussionsView,
     UserRankingView,
 )
 
 logged_users_redirect = user_passes_test(lambda u: u.is_anonymous, "/")
+home_view = cache_anonymous_page(HomeView.as_view())
 
 urlpatterns = [
-    path("", HomeView.as_view(), name="home"),
-    path("top/", HomeView.as_view(), {"sorting": "top"}, name="top"),
-    path("hot/", HomeView.as_view(), {"sorting": "hot"}, name="hot"),
-    path("entries/tag/<str:tag>/", HomeView.as_view(), name="tag"),
+    path("", home_view, name="home"),
+    path("top/", home_view, {"sorting": "top"}, name="top"),
+    path("hot/", home_view, {"sorting": "hot"}, name="hot"),
+    path("entries/tag/<str:tag>/", home_view, name="tag"),
     path("ranking/", UserRankingView.as_view(), name="ranking"),
+    path("search/", SearchView.as_view(), name="search"),
+    path("timeline/", TimelineView.as_view(), name="timeline"),
     path("entries/<int:pk>/", EntryDetailView.as_view(), name="entry-detail-view"),
     path("notifications/", NotificationListView.as_view(), name="notifications-all"),
     path("inbox/", PrivateMessageView.as_view(), name="inbox"),
@@ -26,5 +35,12 @@
         "inbox/user/<str:target>/", PrivateMessageView.as_view(), name="inbox-user-view"
     ),
     path("users/<str:username>/", UserDetailView.as_view(), name="user-detail-view"),
+    path(
+        "users/<str:username>/discussions/",
+        UserDiscussionsView.as_view(),
+        name="user-discussions-view",
+    ),
     path("signup/", logged_users_redirect(SignUpView.as_view()), name="account_signup"),
+    path("metrics", MetricsView.as_view(), name="metrics"),
+    path("export/", ExportView.as_view(), name="export"),
 ]
@@ -1,23 +1,82 @@
 import re
+from collections import defaultdict
 from datetime import timedelta
 
 from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.mixins import LoginRequiredMixin
-from django.core.exceptions import ObjectDoesNotExist
+from django.core.exceptions import ObjectDoesNotExist, PermissionDenied
 from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
-from django.db.models import Count, Q
-from django.http import Http404
+from django.db.models import Count, Exists, Max, OuterRef, Q
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    StreamingHttpResponse,
+)
 from django.shortcuts import get_object_or_404, redirect, render
 from django.urls import reverse_lazy
 from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
 from django.utils.translation import gettext_lazy as _
 from django.views import View
 from django.views.generic.detail import DetailView
 from django.views.generic.list import ListView
 
+from . import exporter, metrics
+from .conditional import conditional_entry
 from .forms import SignUpForm
-from .models import Entry, Notification, PrivateMessage, Tag, User
+from .models import (
+    Entry,
+    EntryTag,
+    Notification,
+    PrivateMessage,
+    Tag,
+    User,
+    cache_root_users,
+    subquery_count,
+    user_points,
+)
+from .search import InvalidCursor, search_entries
+from .timeline import get_timeline
+from .trending import get_trending_tags
+
+
+def get_page(request, paginator):
+    """
+    Returns a page of paginator requested by 'page' GET parameter.
+    Falls back to the first or the last page if page is invalid.
+    """
+    page = request.GET.get("page")
+    try:
+        return paginator.page(page)
+    except PageNotAnInteger:
+        return paginator.page(1)
+    except EmptyPage:
+        return paginator.page(paginator.num_pages)
+
+
+def build_trees(request, tree_ids):
+    """
+    Fetches trees with given ids in a single query and returns their nodes
+    in order of tree_ids, ready to be rendered with 'recursetree'.
+    Entries with level higher than 8 are hidden and their parents
+    are marked that they have hidden children.
+    """
+    trees = defaultdict(list)
+    for node in Entry.objects.filter(tree_id__in=tree_ids, level__lte=9).with_tree_data(
+        request.user
+    ):
+        trees[node.tree_id].append(node)
+    nodes = []
+    for tree_id in tree_ids:
+        for node in trees[tree_id]:
+            if node.level == 9:
+                nodes[-1].has_hidden_children = True
+                continue
+            nodes.append(node)
+    return cache_root_users(nodes)
 
 
 class SignUpView(View):
@@ -45,7 +104,11 @@ class NotificationListView(LoginRequiredMixin, ListView):
     context_object_name = "notifications_paginated"
 
     def get_queryset(self):
-        return Notification.objects.filter(target=self.request.user)
+        return (
+            Notification.objects.filter(target=self.request.user)
+            .select_related("sender")
+            .prefetch_related("object")
+        )
 
 
 class PrivateMessageView(LoginRequiredMixin, View):
@@ -66,10 +129,14 @@ def get(self, request, target=None):
             PrivateMessage.objects.filter(
                 Q(target=self.request.user) & Q(author=target)
             ).update(read=True, read_date=timezone.now())
-            context["conversation"] = PrivateMessage.objects.filter(
-                (Q(target=self.request.user) & Q(author=target))
-                | (Q(target=target) & Q(author=self.request.user))
-            ).order_by("created_date")
+            context["conversation"] = (
+                PrivateMessage.objects.filter(
+                    (Q(target=self.request.user) & Q(author=target))
+                    | (Q(target=target) & Q(author=self.request.user))
+                )
+                .select_related("author")
+                .order_by("created_date")
+            )
 
             context["conversation_with"] = target.username
         else:
@@ -118,9 +185,10 @@ class UserRankingView(ListView):
     template_name = "app/ranking.html"
 
     def get_queryset(self):
-        return sorted(User.objects.all(), key=lambda u: u.points, reverse=True)
+        return User.objects.annotate(points=user_points()).order_by("-points", "pk")
 
 
+@method_decorator(conditional_entry("html"), name="dispatch")
 class EntryDetailView(DetailView):
     """
     This view returns a queryset consiting of:
@@ -128,25 +196,26 @@ class EntryDetailView(DetailView):
     - Selected entry
     - Child entries (if exist)
     as 'entries'
+    Responses have ETag and Last-Modified so unchanged discussions get 304.
     """
 
     model = Entry
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        queryset = []
-        entry = super().get_object()
-        if entry.parent:
-            queryset.append(entry.parent)
-        for e in entry.get_descendants(include_self=True):
-            queryset.append(e)
-        context["entries"] = queryset
+        entry = self.object
+        queryset = Entry.objects.filter(
+            Q(pk=entry.parent_id)
+            | Q(tree_id=entry.tree_id, lft__gte=entry.lft, rght__lte=entry.rght)
+        ).with_tree_data(self.request.user)
+        context["entries"] = cache_root_users(list(queryset))
         return context
 
 
 class UserDetailView(DetailView):
     model = User
     context_object_name = "user_profile"
+    discussions_count = 5
 
     def get_object(self, queryset=None):
         """
@@ -174,102 +243,246 @@ def get_object(self, queryset=None):
             )
         return obj
 
-    def get_context_data(self, **kwargs):
+    def get_discussions(self):
+        """
+        Returns ids of trees user participated in, starting with the most recent
+        """
+        return (
+            Entry.objects.filter(user=self.object)
+            .values("tree_id")
+            .annotate(last_activity=Max("created_date"))
+            .order_by("-last_activity")
+            .values_list("tree_id", flat=True)
+        )
+
+    def get_entries(self):
         """
         Shows only 5 last discussions user participated in
         """
+        tree_ids = list(self.get_discussions()[: self.discussions_count])
+        return build_trees(self.request, tree_ids)
+
+    def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        user_entries = Entry.objects.filter(user=self.get_object().pk)
-        last_discussions = []
-        added_entries = 0
-        for entry in user_entries:
-            if added_entries == 5:
-                break
-            # Skip entries which are already in the list
-            elif any([entry.pk == discussion.pk for discussion in last_discussions]):
-                continue
-            else:
-                added_entries += 1
-            for node in list(entry.get_family()):
-                last_discussions.append(node)
-        context["entries"] = last_discussions
+        context["entries"] = self.get_entries()
         return context
 
 
+class UserDiscussionsView(UserDetailView):
+    """
+    Paginated list of all discussions user participated in
+    """
+
+    extra_context = {"all_discussions": True}
+
+    def get_entries(self):
+        paginator = Paginator(self.get_discussions(), self.discussions_count)
+        page = get_page(self.request, paginator)
+        page.object_list = build_trees(self.request, list(page.object_list))
+        return page
+
+
+class SearchView(View):
+    """
+    Full-text search of entries.
+    Accepts 'q' (query), 'user' (username), 'tag' (tag name)
+    and 'cursor' (next page) GET parameters.
+    """
+
+    template_name = "app/search.html"
+
+    def get(self, request):
+        query = request.GET.get("q", "")
+        context = {"query": query}
+        try:
+            ids, next_cursor = search_entries(
+                query,
+                request.GET.get("user"),
+                request.GET.get("tag"),
+                request.GET.get("cursor"),
+            )
+        except InvalidCursor:
+            raise Http404(_("Invalid cursor"))
+        entries = Entry.objects.with_tree_data(request.user).in_bulk(ids)
+        context["results"] = [entries[pk] for pk in ids if pk in entries]
+        if next_cursor:
+            params = request.GET.copy()
+            params["cursor"] = next_cursor
+            context["next_page"] = params.urlencode()
+        return render(request, self.template_name, context)
+
+
+class TimelineView(LoginRequiredMixin, View):
+    """
+    Root entries with tags observed by user (newest first).
+    Accepts 'before' (id of the last entry of the previous page) GET parameter.
+    """
+
+    template_name = "app/timeline.html"
+    login_url = reverse_lazy("account_login")
+
+    def get(self, request):
+        before = request.GET.get("before")
+        if before is not None and not before.isdigit():
+            raise Http404(_("Invalid cursor"))
+        ids, next_before = get_timeline(
+            request.user, int(before) if before else None, settings.PAGINATE_ENTRIES_BY,
+        )
+        tree_ids = dict(Entry.objects.filter(pk__in=ids).values_list("pk", "tree_id"))
+        context = {
+            "entries": build_trees(
+                request, [tree_ids[pk] for pk in ids if pk in tree_ids]
+            ),
+            "trending_tags": get_trending_tags(),
+        }
+        if next_before:
+            params = request.GET.copy()
+            params["before"] = next_before
+            context["next_page"] = params.urlencode()
+        return render(request, self.template_name, context)
+
+
 class HomeView(View):
     """
     Home (front page) view.
     """
 
-    def filter_roots_by_tag(self, root_nodes, tag_name):
-        if tag_name:
-            if re.search(r"^([a-zA-Z]+)$", tag_name):
-                tag_name = tag_name.lower()
-                tag_object, _ = Tag.objects.get_or_create(name=tag_name)
-                return (root_nodes.filter(tags__name=tag_object.name), tag_object)
-        return (root_nodes, None)
+    def filter_roots_by_tag(self, tag_name):
+        """
+        Returns ids of roots with a tag (newest first) read from the tag feed index
+        and the tag itself. Tags are looked up read-only, unknown tags raise 404.
+        """
+        tag_object = None
+        if re.search(r"^([a-zA-Z]+)$", tag_name):
+            tag_object = Tag.objects.get_cached(tag_name.lower())
+        if tag_object is None:
+            raise Http404(_("No tag found matching the query"))
+        root_ids = (
+            EntryTag.objects.filter(tag=tag_object, is_root=True)
+            .order_by("-created_date")
+            .values_list("entry", flat=True)
+        )
+        return (root_ids, tag_object)
 
     def sort_roots(self, root_nodes, sorting):
+        # Votes and children are counted in subqueries, so counts don't multiply
+        upvotes = subquery_count(
+            Entry.upvotes.through.objects.filter(entry=OuterRef("pk"))
+        )
+        downvotes = subquery_count(
+            Entry.downvotes.through.objects.filter(entry=OuterRef("pk"))
+        )
         # If entries are sorted by hotness, filter entries from last 6 hours
         # Also annotate 'hotness' by a simple formula (count of upvotes + count of downvotes + 0.5 * count of children)
         if sorting == "hot":
+            children = subquery_count(
+                Entry.objects.filter(parent=OuterRef("pk")), field="parent"
+            )
             root_nodes = (
                 root_nodes.filter(created_date__gte=timezone.now() - timedelta(hours=6))
-                .annotate(
-                    hotness=(
-                        (Count("upvotes") + Count("downvotes"))
-                        + (0.5 * Count("children"))
-                    )
-                )
+                .annotate(hotness=((upvotes + downvotes) + (0.5 * children)))
                 .order_by("-hotness")
             )
         # Top sorting sorts descending by subtracting root's downvotes from upvotes
         elif sorting == "top":
             root_nodes = root_nodes.annotate(
-                overall_votes=(Count("upvotes") - Count("downvotes"))
+                overall_votes=(upvotes - downvotes)
             ).order_by("-overall_votes")
         return root_nodes
 
     def filter_roots_by_blacklist(self, request, root_nodes):
-        return root_nodes.exclude(
-            Q(tags__blacklisters=request.user) & ~Q(user=request.user)
+        """
+        Hides roots with tags blacklisted by user (except user's own entries)
+        with a single NOT EXISTS. Skipped if user didn't blacklist any tag.
+        """
+        blacklist = Tag.objects.blacklisted_by(request.user)
+        if not blacklist:
+            return root_nodes
+        blacklisted = ~Exists(
+            EntryTag.objects.filter(entry=OuterRef("pk"), tag__in=blacklist)
+        )
+        return root_nodes.annotate(not_blacklisted=blacklisted).filter(
+            Q(not_blacklisted=True) | Q(user=request.user)
         )
 
-    def rebuild_tree(self, request, root_nodes):
-        # To make pagination possible we need to paginate root nodes only.
+    def rebuild_tree(self, request, root_ids):
+        # To make pagination possible we need to paginate ids of root nodes only.
         # Then we need to replace default object_list in the paginator queryset
         # with a new quryset with rebuilt trees
-        paginator = Paginator(root_nodes, settings.PAGINATE_ENTRIES_BY)
-        page = request.GET.get("page")
-        queryset = []
-        try:
-            queryset = paginator.page(page)
-        except PageNotAnInteger:
-            queryset = paginator.page(1)
-        except EmptyPage:
-            queryset = paginator.page(paginator.num_pages)
-        new_queryset = []
-        for node in queryset.object_list:
-            new_queryset.append(node)
-            for descendant in node.get_descendants():
-                # Hide entries with level higher or equal to 9
-                # and mark parents that they have hidden children
-                if descendant.level >= 9:
-                    if descendant.level == 9:
-                        new_queryset[-1].has_hidden_children = True
-                    continue
-                new_queryset.append(descendant)
-        queryset.object_list = new_queryset
+        paginator = Paginator(root_ids, settings.PAGINATE_ENTRIES_BY)
+        queryset = get_page(request, paginator)
+        root_ids = list(queryset.object_list)
+        tree_ids = dict(
+            Entry.objects.filter(pk__in=root_ids).values_list("pk", "tree_id")
+        )
+        queryset.object_list = build_trees(
+            request, [tree_ids[pk] for pk in root_ids if pk in tree_ids]
+        )
         return queryset
 
     def get(self, request, sorting=None, tag=None):
-        root_nodes = Entry.objects.root_nodes()
         tag_object = None
-        root_nodes, tag_object = self.filter_roots_by_tag(root_nodes, tag)
-        root_nodes = self.sort_roots(root_nodes, sorting)
-        if not tag and request.user.is_authenticated:
-            root_nodes = self.filter_roots_by_blacklist(request, root_nodes)
-        queryset = self.rebuild_tree(request, root_nodes)
+        if tag:
+            root_ids, tag_object = self.filter_roots_by_tag(tag)
+            # Observers and user's choices aren't cached with the tag
+            tag_object = Tag.objects.with_api_data(request.user).get(pk=tag_object.pk)
+        else:
+            root_nodes = self.sort_roots(Entry.objects.root_nodes(), sorting)
+            if request.user.is_authenticated:
+                root_nodes = self.filter_roots_by_blacklist(request, root_nodes)
+            root_ids = root_nodes.values_list("pk", flat=True)
+        queryset = self.rebuild_tree(request, root_ids)
         return render(
-            request, "app/home.html", {"entries": queryset, "browsed_tag": tag_object}
+            request,
+            "app/home.html",
+            {
+                "entries": queryset,
+                "browsed_tag": tag_object,
+                "trending_tags": get_trending_tags(),
+            },
+        )
+
+
+class MetricsView(View):
+    """
+    Metrics of all processes in Prometheus text format.
+    Available to staff users and scrapers sending METRICS_TOKEN as a bearer token.
+    """
+
+    def get(self, request):
+        token = settings.METRICS_TOKEN
+        authorization = request.META.get("HTTP_AUTHORIZATION", "")
+        if not (
+            request.user.is_staff
+            or (token and constant_time_compare(authorization, f"Bearer {token}"))
+        ):
+            raise PermissionDenied
+        return HttpResponse(
+            metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
         )
+
+
+class ExportView(View):
+    """
+    Streams an export (see app.exporter) to staff users.
+
+    ?format=jsonl (default) or csv, ?kinds=entries,votes (all by default)
+    and ?user=<username> to export only data of a user.
+    """
+
+    def get(self, request):
+        if not request.user.is_staff:
+            raise PermissionDenied
+        user = None
+        if request.GET.get("user"):
+            user = get_object_or_404(User, username=request.GET["user"])
+        kinds = [kind for kind in request.GET.get("kinds", "").split(",") if kind]
+        format = request.GET.get("format", "jsonl")
+        try:
+            lines = exporter.export(kinds, format, user)
+        except exporter.InvalidExport as e:
+            return HttpResponseBadRequest(str(e))
+        name = "-".join(["bloggy"] + ([user.username] if user else []) + kinds)
+        response = StreamingHttpResponse(lines, content_type=exporter.FORMATS[format])
+        response["Content-Disposition"] = f'attachment; filename="{name}.{format}"'
+        return response
@@ -0,0 +1,120 @@
+"""
+Compares throughput of SQLite with default pragmas and with pragmas
+applied by app/sqlite.py (SQLITE_PRAGMAS defaults).
+
+Several writer processes insert rows in small transactions (like workers
+creating entries) while reader processes run queries. Reports writes and
+reads per second and number of "database is locked" errors.
+
+Usage: python benchmarks/sqlite_pragmas.py [--writers 4] [--readers 4] [--seconds 5]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import tempfile
+import time
+
+TUNED_PRAGMAS = {
+    "journal_mode": "wal",
+    "busy_timeout": "5000",
+    "synchronous": "normal",
+    "mmap_size": str(256 * 1024 * 1024),
+    "cache_size": "-65536",
+    "temp_store": "memory",
+}
+
+
+def connect(path, pragmas):
+    # Python's sqlite3 waits 5 seconds for locks by default, same as Django
+    connection = sqlite3.connect(path, timeout=5, isolation_level=None)
+    for name, value in pragmas.items():
+        connection.execute(f"PRAGMA {name} = {value}")
+    return connection
+
+
+def writer(path, pragmas, until, results):
+    connection = connect(path, pragmas)
+    done = errors = 0
+    while time.time() < until:
+        try:
+            connection.execute("BEGIN")
+            connection.execute(
+                "INSERT INTO entry (content, created) VALUES (?, ?)",
+                ["x" * 200, time.time()],
+            )
+            connection.execute("UPDATE counter SET value = value + 1 WHERE id = 1")
+            connection.execute("COMMIT")
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+            if connection.in_transaction:
+                connection.execute("ROLLBACK")
+    results.put(("write", done, errors))
+
+
+def reader(path, pragmas, until, results):
+    connection = connect(path, pragmas)
+    done = errors = 0
+    while time.time() < until:
+        try:
+            connection.execute(
+                "SELECT id, content FROM entry ORDER BY id DESC LIMIT 15"
+            ).fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            errors += 1
+    results.put(("read", done, errors))
+
+
+def run(pragmas, writers, readers, seconds):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.sqlite3")
+        connection = connect(path, pragmas)
+        connection.execute(
+            "CREATE TABLE entry (id INTEGER PRIMARY KEY, content TEXT, created REAL)"
+        )
+        connection.execute("CREATE TABLE counter (id INTEGER PRIMARY KEY, value INT)")
+        connection.execute("INSERT INTO counter VALUES (1, 0)")
+        connection.close()
+        results = multiprocessing.Queue()
+        until = time.time() + seconds
+        processes = [
+            multiprocessing.Process(target=writer, args=(path, pragmas, until, results))
+            for _ in range(writers)
+        ] + [
+            multiprocessing.Process(target=reader, args=(path, pragmas, until, results))
+            for _ in range(readers)
+        ]
+        for process in processes:
+            process.start()
+        totals = {"write": [0, 0], "read": [0, 0]}
+        for _ in processes:
+            kind, done, errors = results.get()
+            totals[kind][0] += done
+            totals[kind][1] += errors
+        for process in processes:
+            process.join()
+    return {
+        "writes_per_second": round(totals["write"][0] / seconds, 1),
+        "reads_per_second": round(totals["read"][0] / seconds, 1),
+        "locked_errors": totals["write"][1] + totals["read"][1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+    report = {
+        name: run(pragmas, args.writers, args.readers, args.seconds)
+        for name, pragmas in [("default", {}), ("tuned", TUNED_PRAGMAS)]
+    }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
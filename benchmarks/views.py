@@ -0,0 +1,292 @@
+"""
+Benchmarks of bloggy views and API endpoints.
+
+Creates a throwaway test database filled by a seeded data generator
+(N users, M discussions with heavy-tailed reply counts, realistic depth and
+vote distributions, private messages), runs every scenario through the test
+client and writes latency percentiles, query counts and peak memory to a JSON
+file named after the current commit, so runs can be compared across commits.
+
+Usage: python benchmarks/views.py [--users 200] [--threads 100] [--repeat 30]
+                                  [--output FILE] [--compare BASELINE.json]
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import timedelta
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "bloggy.settings")
+
+import django  # noqa: E402 isort:skip
+
+django.setup()
+
+from django.contrib.auth.hashers import make_password  # noqa: E402 isort:skip
+from django.core.cache import cache  # noqa: E402 isort:skip
+from django.db import connection  # noqa: E402 isort:skip
+from django.test import Client  # noqa: E402 isort:skip
+from django.test.utils import (  # noqa: E402 isort:skip
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+)
+from django.utils import timezone  # noqa: E402 isort:skip
+
+from app.models import Entry, PrivateMessage, User  # noqa: E402 isort:skip
+
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+    "incididunt ut labore et dolore magna aliqua enim ad minim veniam quis nostrud"
+).split()
+TAGS = ["python", "django", "music", "games", "news", "science", "movies", "books"]
+MAX_DEPTH = 10
+
+
+def text(rng, users):
+    words = rng.choices(WORDS, k=rng.randint(5, 40))
+    if rng.random() < 0.3:
+        # Popular tags are used more often
+        words.append("#" + TAGS[min(int(rng.paretovariate(1)) - 1, len(TAGS) - 1)])
+    if rng.random() < 0.1:
+        words.append("@" + rng.choice(users).username)
+    return " ".join(words)
+
+
+def generate_data(users_count, threads_count, seed):
+    """
+    Fills db with users, discussions, votes and private messages.
+    Returns dict of objects used by scenarios.
+    """
+    rng = random.Random(seed)
+    password = make_password("benchmark")
+    User.objects.bulk_create(
+        [
+            User(
+                username=f"user{i}",
+                display_name=f"user{i}",
+                email=f"user{i}@example.com",
+                password=password,
+            )
+            for i in range(users_count)
+        ]
+    )
+    # bulk_create doesn't set primary keys on SQLite
+    users = list(User.objects.order_by("pk"))
+    now = timezone.now()
+    entries = []
+    threads = []
+    for _ in range(threads_count):
+        created_date = now - timedelta(minutes=rng.randint(60, 7 * 24 * 60))
+        root = Entry.objects.create(
+            user=rng.choice(users), content=text(rng, users), created_date=created_date
+        )
+        nodes = [(root, 0)]
+        # Most discussions get few replies, some get a lot
+        for _ in range(min(int(rng.paretovariate(0.8)) - 1, 200)):
+            parent, level = rng.choice(nodes)
+            created_date += timedelta(seconds=rng.randint(1, 600))
+            reply = Entry.objects.create(
+                user=rng.choice(users),
+                content=text(rng, users),
+                parent=parent,
+                created_date=created_date,
+            )
+            if level + 1 < MAX_DEPTH:
+                nodes.append((reply, level + 1))
+        entries.extend(node for node, _ in nodes)
+        threads.append((len(nodes), root))
+    for field, alpha in [("upvotes", 1.2), ("downvotes", 2.5)]:
+        through = getattr(Entry, field).through
+        votes = []
+        for entry in entries:
+            count = min(int(rng.paretovariate(alpha)) - 1, 50, len(users))
+            voters = rng.sample(users, max(count, 0))
+            votes.extend(through(entry_id=entry.pk, user_id=user.pk) for user in voters)
+        through.objects.bulk_create(votes, ignore_conflicts=True)
+    messages = [
+        PrivateMessage(
+            author=rng.choice(users), target=rng.choice(users), text=text(rng, users)
+        )
+        for _ in range(users_count * 5)
+    ]
+    # The benchmarked user has a long conversation
+    messages.extend(
+        PrivateMessage(author=author, target=target, text=text(rng, users))
+        for author, target in [(users[0], users[1]), (users[1], users[0])] * 50
+    )
+    PrivateMessage.objects.bulk_create(messages)
+    biggest = max(threads, key=lambda thread: thread[0])[1]
+    voted = Entry.objects.exclude(user=users[0]).filter(parent=None).first()
+    return {"user": users[0], "other": users[1], "thread": biggest, "voted": voted}
+
+
+def scenarios(data):
+    """
+    Returns list of (name, method, path, authenticated) tuples
+    """
+    thread, voted = data["thread"].pk, data["voted"].pk
+    return [
+        ("home-anonymous", "get", "/", False),
+        ("home", "get", "/", True),
+        ("entry-detail", "get", f"/entries/{thread}/", True),
+        ("ranking", "get", "/ranking/", True),
+        ("inbox", "get", "/inbox/", True),
+        ("inbox-user", "get", f"/inbox/user/{data['other'].username}/", True),
+        ("api-entry-list", "get", "/api-v1/entries/", True),
+        ("api-entry-retrieve", "get", f"/api-v1/entries/{thread}/", True),
+        ("api-entry-upvote", "post", f"/api-v1/entries/{voted}/upvote/", True),
+    ]
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def measure(client, method, path, repeat, warmup, warm_cache):
+    def request():
+        response = getattr(client, method)(path)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method.upper()} {path}: {response.status_code}")
+
+    for _ in range(warmup):
+        request()
+    latencies, queries, peaks = [], [], []
+    for _ in range(repeat):
+        if not warm_cache:
+            cache.clear()
+        with CaptureQueriesContext(connection) as captured:
+            start = time.perf_counter()
+            request()
+            latencies.append((time.perf_counter() - start) * 1000)
+        queries.append(len(captured))
+    # tracemalloc slows requests down, so memory is measured separately
+    for _ in range(min(repeat, 5)):
+        if not warm_cache:
+            cache.clear()
+        tracemalloc.start()
+        request()
+        peaks.append(tracemalloc.get_traced_memory()[1] / 1024)
+        tracemalloc.stop()
+    return {
+        "method": method.upper(),
+        "path": path,
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p90_ms": round(percentile(latencies, 90), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.mean(latencies), 2),
+        "max_ms": round(max(latencies), 2),
+        "queries": max(queries),
+        "peak_memory_kib": round(statistics.median(peaks), 1),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report, baseline):
+    print(f"{'scenario':<20} {'p50 ms':>18} {'queries':>12} {'memory KiB':>22}")
+    for name, result in report["results"].items():
+        old = baseline["results"].get(name)
+        if old is None:
+            continue
+        print(
+            f"{name:<20} {old['p50_ms']:>8} -> {result['p50_ms']:<8}"
+            f"{old['queries']:>5} -> {result['queries']:<5}"
+            f"{old['peak_memory_kib']:>10} -> {result['peak_memory_kib']:<10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--threads", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument(
+        "--warm-cache",
+        action="store_true",
+        help="keep cache between requests (by default it's cleared before each one)",
+    )
+    parser.add_argument("--only", nargs="*", help="names of scenarios to run")
+    parser.add_argument("--output", help="defaults to benchmarks/results/COMMIT.json")
+    parser.add_argument("--compare", help="results of an earlier run")
+    args = parser.parse_args()
+
+    setup_test_environment()
+    databases = setup_databases(verbosity=0, interactive=False, keepdb=False)
+    try:
+        started = time.perf_counter()
+        data = generate_data(args.users, args.threads, args.seed)
+        print(
+            f"Generated {Entry.objects.count()} entries"
+            f" in {time.perf_counter() - started:.1f}s",
+            file=sys.stderr,
+        )
+        client = Client()
+        client.force_login(data["user"])
+        anonymous = Client()
+        results = {}
+        for name, method, path, authenticated in scenarios(data):
+            if args.only and name not in args.only:
+                continue
+            results[name] = measure(
+                client if authenticated else anonymous,
+                method,
+                path,
+                args.repeat,
+                args.warmup,
+                args.warm_cache,
+            )
+            print(f"{name}: {results[name]}", file=sys.stderr)
+    finally:
+        teardown_databases(databases, verbosity=0)
+
+    commit = current_commit()
+    report = {
+        "commit": commit,
+        "date": timezone.now().isoformat(),
+        "python": platform.python_version(),
+        "django": django.get_version(),
+        "database": connection.vendor,
+        "options": {
+            key: getattr(args, key)
+            for key in ["users", "threads", "seed", "repeat", "warmup", "warm_cache"]
+        },
+        "results": results,
+    }
+    output = args.output or os.path.join(
+        BASE_DIR, "benchmarks", "results", f"{commit}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {output}", file=sys.stderr)
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@
     NotificationViewSet,
     PrivateMessageViewSet,
     TagViewSet,
+    TrendingTagViewSet,
 )
 
 router = routers.DefaultRouter()
@@ -12,3 +13,4 @@
 router.register(r"notifications", NotificationViewSet, basename="notifications")
 router.register(r"privatemessages", PrivateMessageViewSet, basename="privatemessages")
 router.register(r"tags", TagViewSet, basename="tags")
+router.register(r"trending-tags", TrendingTagViewSet, basename="trending-tags")
@@ -0,0 +1,17 @@
+"""
+Test runner which keeps files of test runs out of the project directory.
+"""
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs tests with metrics kept in memory (METRICS_DIR = None), so requests
+    made by tests don't write files of test processes to metrics/.
+    The override isn't disabled, metrics are written when the process exits.
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        override_settings(METRICS_DIR=None).enable()